@@ -1,52 +1,115 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 import numpy as np
 
-from airport_util import calculate_lookhead_matrix
-
 
 """
 Define configuration parameters here
 Change these to run for various configurations
 """
-num_runways_per_airport = 5
+num_runways_per_airport = 5 #mixed runways, used for landings and departures
+num_arrival_runways_per_airport = 0
+num_departure_runways_per_airport = 0
+#Runway counts of single airports, airport_id -> (mixed, arrival-only, departure-only),
+#e.g. {0: (2, 4, 3)} for a hub
+runways_by_airport = {}
 num_airports = 3
 num_airplanes = 1000
 
 distance_min = 600
 distance_max = 4000
 
+#Route network, see route_network.py: "complete" (every airport connects to every
+#other one), "geo" (routes to the routes_per_airport nearest airports and to the
+#nearest of num_hub_airports hubs) or the path of a .npz or .csv network file
+route_network = "complete"
+routes_per_airport = 8
+num_hub_airports = 0
+
+#Distances are flight times of the slowest planes, every plane gets a speed
+#drawn from [plane_speed_min, plane_speed_max]
+plane_capacity = 200
+plane_speed_min = 550
+plane_speed_max = 550
+
 runway_time_to_land = 30
 required_time_on_ground = 100
 runway_time_to_takeoff = 30
 
+#Which waiting plane gets a free mixed runway (see runway_scheduler.py):
+#"landing_first", "fifo" or "weighted" (by waiting time, a circling plane
+#burns fuel so its waiting time weighs more)
+runway_priority_policy = "landing_first"
+landing_wait_weight = 2.0
+departure_wait_weight = 1.0
+
 seed = 1
 max_simulation_time = 100000
 
+#Dispatch all events of the same time, airport and event type in one step
+#(see Airport.handle_events) instead of one event at a time. The results and
+#traces are the same either way, it needs runway times > 0, see README.md
+batch_same_time_events = False
+
+#Number of logical processes (LPs) hosted by each MPI rank in the YAWNS and
+#null message simulators. LPs on the same rank exchange events in memory
+lps_per_rank = 1
+
+#Format of the per-LP output files: "text" (output_<lp>.txt) or
+#"binary" (output_<lp>.bin, see airport_util.trace_record_dtype)
+log_format = "text"
+
+#Memory budget for long runs. Every event list keeps at most max_events_in_memory
+#events in memory and spills later events to sorted run files in spill_dir
+#(None: the system temp folder), see event_queue.py
+max_events_in_memory = None
+spill_dir = None
+#Backpressure: a YAWNS rank stops processing its window once max_outgoing_events
+#events wait for the exchange, a null message rank waits for its MPI sends once
+#max_pending_sends are pending (max_outgoing_events >= 1)
+max_outgoing_events = None
+max_pending_sends = None
+#Output files are written through a buffer of log_buffer_size bytes and stop
+#growing at max_log_size bytes (None for no limit), later events are not logged
+log_buffer_size = 1 << 20
+max_log_size = None
+
+#Folder the results of every run are appended to (see results_export.py),
+#None to only print them. results_format is "npy", "parquet" (needs pyarrow)
+#or "auto" (parquet if pyarrow is installed)
+results_dir = None
+results_format = "auto"
+#Waiting times are also kept as histograms, the last bin holds all longer waits
+waiting_time_bin_width = 30
+num_waiting_time_bins = 64
+
+#Live telemetry (see telemetry.py): rank zero publishes the progress of the run
+#every telemetry_interval seconds as JSON to telemetry_file and/or at
+#http://localhost:<telemetry_port>/ (None to disable either)
+telemetry_file = None
+telemetry_port = None
+telemetry_interval = 2.0
+
 """ -------------------------------------------"""
 
 np.random.seed(seed)
 
 class SimulatorParams:
   def __init__(self):
-    self.distance = self.prepare_distance_matrix()
-
-  def prepare_distance_matrix(self):
-    d = np.random.random_integers(distance_min, distance_max, size=(num_airports, num_airports))
-    d = d - np.triu(d)
-    return (d + d.T)/2
+    from route_network import create_route_network
+    self.network = create_route_network(num_airports)
 
   def get_all_airport_ids(self):
-    return range(num_airports)
+    return list(range(num_airports))
 
-  def get_distance_matrix(self):
-    return self.distance
+  def get_route_network(self):
+    return self.network
 
-  def get_distance_between(self, id1, id2):
-    return self.distance[id1][id2]
+  def get_destinations(self, airport_id):
+    return self.network.get_destinations(airport_id)
 
 
 if __name__ == "__main__":
+  from airport_util import calculate_lookhead_matrix
   sp = SimulatorParams()
-  dis = sp.prepare_distance_matrix()
-  calculate_lookhead_matrix(dis, 3)
\ No newline at end of file
+  print(calculate_lookhead_matrix(sp.get_route_network(), 3))
@@ -1,11 +1,13 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 import numpy as np
 
 import airport_conf as conf
 
-from collections import deque
 from enum import IntEnum
+from runway_scheduler import DEPARTURE
+from runway_scheduler import LANDING
+from runway_scheduler import RunwayScheduler
 
 
 class EventType(IntEnum):
@@ -14,41 +16,98 @@ class EventType(IntEnum):
   READY_FOR_TAKEOFF = 3 #When the plane is on the runway and is taking off
   PLANE_DEPARTS       = 4 #When the plane has departed and the runway can be used by next plane
   NULL_MSG = 5
+  TERMINATION_TOKEN = 6 #Control message for the termination detection wave
+  STOP = 7 #Control message announcing that the simulation has terminated
 
 
 class AirportEvent(object):
-  def __init__(self, event_type, event_time, airport, source_pid=-1):
+  def __init__(self, event_type, event_time, airport, plane_id=-1, source_pid=-1):
     self.type = event_type
     self.time = event_time
     self.airport = airport #the airport at which this event occurs (destination)
+    self.plane_id = plane_id #index of the plane in the Fleet (-1 for null messages)
     self.source_pid = source_pid #Logical process_id for the source process
+    #Ties in time are broken by airport, event type and plane, so that every
+    #engine processes simultaneous events in the same order
+    airport_id = airport.id if airport is not None else -1
+    self.key = (event_time, airport_id, event_type, plane_id)
 
-  def __cmp__(self, other):
-    return cmp(self.time, other.time)
+  #Events are ordered by their key, heapq and sort only use <
+  def __lt__(self, other):
+    return self.key < other.key
 
 
-class Airplane:
-  def __init__(self):
-    self.num_passengers = np.random.randint(200)
+class Fleet(object):
+  """
+  State of all the planes, kept in arrays indexed by plane id so that events
+  only carry the plane id. Every simulator (every rank for MPI) holds the arrays
+  of the whole fleet and updates the planes of the events it handles, so the
+  per-plane counters of all ranks add up to the totals.
+  The methods take a plane id or an array of distinct plane ids"""
+  def __init__(self, num_airplanes):
+    #A stream of its own, distinct from the airports' [seed, airport_id]
+    rng = np.random.RandomState([conf.seed, conf.num_airports])
+    self.airport_id = np.zeros(num_airplanes, dtype=np.int32) #current airport or destination
+    self.num_passengers = np.zeros(num_airplanes, dtype=np.int32) #passengers on the last flight
+    self.capacity = np.empty(num_airplanes, dtype=np.int32)
+    self.capacity.fill(conf.plane_capacity)
+    self.speed = rng.randint(conf.plane_speed_min, conf.plane_speed_max+1, size=num_airplanes).astype(np.int32)
+    #Variables to compute statistics
+    self.cnt_flights = np.zeros(num_airplanes, dtype=np.int64) #completed flights
+    self.time_in_air = np.zeros(num_airplanes, dtype=np.int64)
+    self.passengers_flown = np.zeros(num_airplanes, dtype=np.int64)
+
+  def get_travel_time(self, plane_id, distance):
+    """
+    Distances are flight times of the slowest planes (plane_speed_min),
+    faster planes need proportionally less"""
+    return np.ceil(distance * float(conf.plane_speed_min) / self.speed[plane_id]).astype(np.int64)
+
+  def depart(self, plane_id, nxt_airport_id, travel_time):
+    self.airport_id[plane_id] = nxt_airport_id
+    self.time_in_air[plane_id] += travel_time
+
+  def land(self, plane_id, airport_id, rng):
+    """Draws the passengers of the flight that has landed, returns their number"""
+    num_passengers = (rng.random_sample(np.shape(plane_id)) * self.capacity[plane_id]).astype(np.int64)
+    self.airport_id[plane_id] = airport_id
+    self.num_passengers[plane_id] = num_passengers
+    self.cnt_flights[plane_id] += 1
+    self.passengers_flown[plane_id] += num_passengers
+    return num_passengers
+
+
+def get_waiting_time_bin(waiting_time):
+  """Histogram bin of a waiting time, the last bin holds all longer waits"""
+  return min(int(waiting_time) // conf.waiting_time_bin_width, conf.num_waiting_time_bins - 1)
+
 
 class Airport(object):
   """
-  Handles all events at a given airport and schedules new events at other airports"""
+  Handles all events at a given airport and schedules new events at other airports.
+  The runways are assigned by a RunwayScheduler"""
   def __init__(self, id, simulator):
     self.id = id
     self.name = "AIRPORT-" + str(id)
     self.sim = simulator
-    self.cnt_runways_in_use = 0
-    self.q_waiting_to_land = deque()
-    self.q_waiting_to_depart = deque()
+    #Every airport draws from its own stream, so the draws don't depend on
+    #which LP hosts the airport or how events of different airports interleave
+    self.rng = np.random.RandomState([conf.seed, id])
+    self.runways = RunwayScheduler(id)
+    #the routes leaving this airport
+    self.destinations, self.route_distances = simulator.get_destinations(id)
     #Variables to compute statistics
-    self.cnt_waiting_to_land = 0
+    self.cnt_waiting_to_land = 0 #planes that had to wait for a runway
     self.cnt_waiting_to_depart = 0
     self.total_waiting_time_for_landing = 0
     self.total_waiting_time_for_departing = 0
     self.cnt_landings = 0
     self.cnt_departures = 0
     self.cnt_passengers_arriving = 0
+    self.cnt_planes_grounded = 0
+    self.cnt_events = 0
+    self.landing_waiting_time_hist = np.zeros(conf.num_waiting_time_bins, dtype=np.int64)
+    self.departure_waiting_time_hist = np.zeros(conf.num_waiting_time_bins, dtype=np.int64)
 
 
 
@@ -56,68 +115,99 @@ class Airport(object):
     event_type = event.type
     curr_time = self.sim.get_curr_time()
     self.sim.log(event)
+    self.cnt_events += 1
     if event_type == EventType.PLANE_ARRIVES:
-      if self.cnt_runways_in_use < conf.num_runways_per_airport:
-        self.cnt_runways_in_use += 1
-        nxt_event_tuple = (EventType.PLANE_LANDED, curr_time+conf.runway_time_to_land, self.id)
-        self.sim.schedule(nxt_event_tuple)
-      else:
-        self.cnt_waiting_to_land += 1
-        self.q_waiting_to_land.appendleft(event)
+      self.runways.request(LANDING, event.plane_id, curr_time)
 
     elif event_type == EventType.PLANE_LANDED:
       self.cnt_landings += 1
-      self.cnt_runways_in_use -= 1
-      nxt_event_tuple = (EventType.READY_FOR_TAKEOFF, curr_time+conf.required_time_on_ground, self.id)
-      airplane = Airplane()
-      self.cnt_passengers_arriving += airplane.num_passengers
-      self.sim.schedule(nxt_event_tuple)
-      assert self.cnt_runways_in_use >= 0
-      self.notify_waiting_planes(curr_time)
+      self.runways.release(event.plane_id)
+      self.cnt_passengers_arriving += self.sim.get_fleet().land(event.plane_id, self.id, self.rng)
+      self.prepare_for_takeoff(curr_time, event.plane_id)
 
     elif event_type == EventType.READY_FOR_TAKEOFF:
-      if self.cnt_runways_in_use < conf.num_runways_per_airport:
-        self.cnt_runways_in_use += 1
-        nxt_event_tuple = (EventType.PLANE_DEPARTS, curr_time+conf.runway_time_to_takeoff, self.id)
-        self.sim.schedule(nxt_event_tuple)
-      else:
-        self.cnt_waiting_to_depart += 1
-        self.q_waiting_to_depart.appendleft(event)
+      self.runways.request(DEPARTURE, event.plane_id, curr_time)
 
     elif event_type == EventType.PLANE_DEPARTS:
       self.cnt_departures += 1
-      self.cnt_runways_in_use -= 1
-      airport_ids = set(self.sim.get_all_airport_ids())
-      airport_ids.remove(self.id)
-      airport_ids = list(airport_ids)
-      nxt_airport_id = np.random.choice(airport_ids, 1)[0]
-      travel_time = self.sim.get_distance(self.id, nxt_airport_id)
-      nxt_event_tuple = (EventType.PLANE_ARRIVES, curr_time+travel_time, nxt_airport_id)
+      self.runways.release(event.plane_id)
+      route = self.rng.choice(len(self.destinations), 1)[0]
+      nxt_airport_id = self.destinations[route]
+      fleet = self.sim.get_fleet()
+      travel_time = fleet.get_travel_time(event.plane_id, self.route_distances[route])
+      fleet.depart(event.plane_id, nxt_airport_id, travel_time)
+      nxt_event_tuple = (EventType.PLANE_ARRIVES, curr_time+travel_time, nxt_airport_id, event.plane_id)
       self.sim.schedule(nxt_event_tuple)
-      assert self.cnt_runways_in_use >= 0
+
+    self.notify_waiting_planes(curr_time)
+
+
+  def handle_events(self, events):
+    """
+    Handles the events of one type that occur at this airport at the current
+    time, in plane order (see airport_util.dispatch_group), with one draw for
+    all their planes. Runway requests share the request time and are dispatched
+    together, so the same planes get the same runways, and every release is
+    dispatched on its own, so the runways are granted exactly as by
+    handle_event, one event at a time"""
+    curr_time = self.sim.get_curr_time()
+    self.sim.log_batch(events)
+    self.cnt_events += len(events)
+    event_type = events[0].type
+    plane_ids = [event.plane_id for event in events]
+    if event_type == EventType.PLANE_ARRIVES or event_type == EventType.READY_FOR_TAKEOFF:
+      kind = LANDING if event_type == EventType.PLANE_ARRIVES else DEPARTURE
+      for plane_id in plane_ids:
+        self.runways.request(kind, plane_id, curr_time)
       self.notify_waiting_planes(curr_time)
+      return
 
+    for plane_id in plane_ids:
+      self.runways.release(plane_id)
+      self.notify_waiting_planes(curr_time)
+    plane_ids = np.array(plane_ids)
+    fleet = self.sim.get_fleet()
+    if event_type == EventType.PLANE_LANDED:
+      self.cnt_landings += len(plane_ids)
+      self.cnt_passengers_arriving += fleet.land(plane_ids, self.id, self.rng).sum()
+      for plane_id in plane_ids:
+        self.prepare_for_takeoff(curr_time, plane_id)
+    else:
+      self.cnt_departures += len(plane_ids)
+      routes = self.rng.choice(len(self.destinations), len(plane_ids))
+      nxt_airport_ids = self.destinations[routes]
+      travel_times = fleet.get_travel_time(plane_ids, self.route_distances[routes])
+      fleet.depart(plane_ids, nxt_airport_ids, travel_times)
+      for nxt_airport_id, arrival_time, plane_id in zip(nxt_airport_ids, curr_time + travel_times, plane_ids):
+        self.sim.schedule((EventType.PLANE_ARRIVES, arrival_time, nxt_airport_id, plane_id))
+
+
+  def prepare_for_takeoff(self, curr_time, plane_id):
+    """
+    Schedules the next takeoff of a plane that has landed. Once the simulation
+    time is past max_simulation_time planes stay on the ground (soft stop),
+    so the simulation winds down in every engine in the same way"""
+    if curr_time > conf.max_simulation_time:
+      self.cnt_planes_grounded += 1
+      return
+    nxt_event_tuple = (EventType.READY_FOR_TAKEOFF, curr_time+conf.required_time_on_ground, self.id, plane_id)
+    self.sim.schedule(nxt_event_tuple)
 
 
   def notify_waiting_planes(self, curr_time):
-    """Prefers planes waiting to land over those waiting to depart"""
-    if self.cnt_waiting_to_land > 0:
-      assert self.cnt_waiting_to_land == len(self.q_waiting_to_land)
-      self.cnt_runways_in_use += 1
-      self.cnt_waiting_to_land -= 1
-      pending_event = self.q_waiting_to_land.pop()
-      assert pending_event.type == EventType.PLANE_ARRIVES
-      assert curr_time >= pending_event.time
-      self.total_waiting_time_for_landing = curr_time - pending_event.time
-      nxt_event_tuple = (EventType.PLANE_LANDED, curr_time+conf.runway_time_to_land, self.id)
+    """Schedules the landings and departures of the planes granted a free runway"""
+    for kind, plane_id, request_time in self.runways.dispatch(curr_time):
+      waiting_time = curr_time - request_time
+      if kind == LANDING:
+        if waiting_time > 0:
+          self.cnt_waiting_to_land += 1
+        self.total_waiting_time_for_landing += waiting_time
+        self.landing_waiting_time_hist[get_waiting_time_bin(waiting_time)] += 1
+        nxt_event_tuple = (EventType.PLANE_LANDED, curr_time+conf.runway_time_to_land, self.id, plane_id)
+      else:
+        if waiting_time > 0:
+          self.cnt_waiting_to_depart += 1
+        self.total_waiting_time_for_departing += waiting_time
+        self.departure_waiting_time_hist[get_waiting_time_bin(waiting_time)] += 1
+        nxt_event_tuple = (EventType.PLANE_DEPARTS, curr_time+conf.runway_time_to_takeoff, self.id, plane_id)
       self.sim.schedule(nxt_event_tuple)
-    elif self.cnt_waiting_to_depart > 0:
-      assert self.cnt_waiting_to_depart == len(self.q_waiting_to_depart)
-      self.cnt_runways_in_use += 1
-      self.cnt_waiting_to_depart -= 1
-      pending_event = self.q_waiting_to_depart.pop()
-      assert pending_event.type == EventType.READY_FOR_TAKEOFF
-      assert curr_time >= pending_event.time
-      self.total_waiting_time_for_departing = curr_time - pending_event.time
-      nxt_event_tuple = (EventType.PLANE_DEPARTS, curr_time+conf.runway_time_to_takeoff, self.id)
-      self.sim.schedule(nxt_event_tuple)
\ No newline at end of file
@@ -1,22 +1,43 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 import os
 import math
 import numpy as np
+import re
+import resource
 import shutil
-import sys
 
+import airport_conf as conf
+
+from airport_sim import Airport
+from airport_sim import AirportEvent
 from airport_sim import EventType
+from collections import defaultdict
+from event_queue import EventQueue
 
 """
 Various util methods go here
 """
 
+eventtype_msg_map = {EventType.PLANE_ARRIVES: "arrives at ",
+                     EventType.PLANE_LANDED : "landed at ",
+                     EventType.READY_FOR_TAKEOFF: "ready for takeoff from ",
+                     EventType.PLANE_DEPARTS: "departing from "}
+log_line_pattern = re.compile(r"^(-?\d+): Plane (-?\d+) (.*) AIRPORT-(\d+)$")
+
+#Record of the binary output files (log_format = "binary")
+trace_record_dtype = np.dtype([("time", "<i8"), ("airport_id", "<i4"), ("event_type", "<i4"),
+                               ("plane_id", "<i4")])
+
+
 class EventLogger:
   def __init__(self, rank, name, shard_output_by_lp=False):
     self.shard_output=shard_output_by_lp
     self.name = name
     self.output_dir = os.path.join(os.curdir, self.name)
+    self.output_files = {} #open output file of every LP
+    self.cnt_bytes_logged = defaultdict(int)
+    self.cnt_not_logged = 0 #events of output files that reached conf.max_log_size
     if rank == 0:
       self.setup_dir()
 
@@ -26,27 +47,154 @@ class EventLogger:
     os.mkdir(self.output_dir)
 
   def log(self, event, curr_time, rank=0):
-    output_path = os.path.join(self.output_dir, 'output_{r}.txt'.format(r=rank))
-    with open(output_path, 'a') as output_file:
-      eventtype_msg_map = {EventType.PLANE_ARRIVES: "Plane arrives at ",
-                           EventType.PLANE_LANDED : "Plane landed at ",
-                           EventType.READY_FOR_TAKEOFF: "Plane ready for takeoff from ",
-                           EventType.PLANE_DEPARTS: "Plane departing from "}
-      line = "{time}: {eventtype_msg} {airport_name}\n".format(
-        time=curr_time, eventtype_msg=eventtype_msg_map[event.type],
-        airport_name=event.airport.name)
-      output_file.write(line)
-
-
-def calculate_lookhead_matrix(distance, num_processes):
-  num_airports = len(distance)
+    self.log_batch([event], curr_time, rank)
+
+  def log_batch(self, events, curr_time, rank=0):
+    """Logs events that all happen at curr_time with a single write"""
+    if conf.log_format == "binary":
+      records = np.array([(curr_time, event.airport.id, event.type, event.plane_id) for event in events],
+                         dtype=trace_record_dtype)
+      data = records.tobytes()
+    else:
+      lines = [format_log_line(curr_time, event.airport.name, event.type, event.plane_id)
+               for event in events]
+      data = "".join(lines).encode("ascii")
+    if conf.max_log_size is not None and self.cnt_bytes_logged[rank] + len(data) > conf.max_log_size:
+      self.cnt_not_logged += len(events)
+      return
+    self.get_output_file(rank).write(data)
+    self.cnt_bytes_logged[rank] += len(data)
+
+  def get_output_file(self, rank):
+    if rank not in self.output_files:
+      extension = "bin" if conf.log_format == "binary" else "txt"
+      output_path = os.path.join(self.output_dir, 'output_{r}.{ext}'.format(r=rank, ext=extension))
+      self.output_files[rank] = open(output_path, 'ab', conf.log_buffer_size)
+    return self.output_files[rank]
+
+  def close(self):
+    """Flushes and closes the output files"""
+    for output_file in self.output_files.values():
+      output_file.close()
+    self.output_files = {}
+    if self.cnt_not_logged > 0:
+      print(self.cnt_not_logged, "events not logged to", self.name, "after reaching max_log_size")
+
+
+def get_peak_memory_mb():
+  """Peak resident memory of this process"""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def format_log_line(curr_time, airport_name, event_type, plane_id):
+  return "{time}: Plane {plane_id} {eventtype_msg} {airport_name}\n".format(
+    time=curr_time, plane_id=plane_id, eventtype_msg=eventtype_msg_map[event_type],
+    airport_name=airport_name)
+
+
+def parse_log_line(line):
+  """
+  Inverse of EventLogger.log, returns the (time, airport_id, event_type, plane_id)
+  of a line of an output file"""
+  match = log_line_pattern.match(line.strip())
+  if match is not None:
+    eventtype_msg = match.group(3).strip()
+    for event_type, msg in eventtype_msg_map.items():
+      if msg.strip() == eventtype_msg:
+        return (int(match.group(1)), int(match.group(4)), int(event_type), int(match.group(2)))
+  raise ValueError("Unknown event in line: " + line)
+
+
+def draw_initial_departures(airport_ids):
+  """
+  Draws the airport and the initial departure time of every plane, the plane id
+  is the index in the returned list. All LPs draw the same values from a generator
+  seeded with conf.seed and keep the planes of their own airports, so the initial
+  events don't depend on the LP layout"""
+  rng = np.random.RandomState(conf.seed)
+  init_airport_ids = rng.choice(airport_ids, conf.num_airplanes)
+  init_departure_times = rng.randint(20, size=conf.num_airplanes)
+  return list(zip(init_airport_ids, init_departure_times))
+
+
+class LogicalProcess(object):
+  """
+  A logical process (LP) hosted by an MPI rank. It owns a subset of the airports
+  and their event heap, while the hosting simulator routes the events it schedules
+  (same LP, another LP on the same rank or an LP on another rank)"""
+  def __init__(self, lp_id, host):
+    self.id = lp_id
+    self.host = host
+    self.airports = {} #airport objs for this LP
+    self.pq = EventQueue(self.airports, conf.max_events_in_memory)
+    self.curr_time = 0
+
+  def add_airport(self, airport_id):
+    airport = Airport(airport_id, self)
+    self.airports[airport_id] = airport
+    return airport
+
+  def get_all_airport_ids(self):
+    return self.host.get_all_airport_ids()
+
+  def get_destinations(self, airport_id):
+    return self.host.get_destinations(airport_id)
+
+  def get_fleet(self):
+    return self.host.fleet
+
+  def get_curr_time(self):
+    return self.curr_time
+
+  def log(self, event):
+    self.host.logger.log(event, self.curr_time, self.id)
+
+  def log_batch(self, events):
+    self.host.logger.log_batch(events, self.curr_time, self.id)
+
+  def schedule(self, event_tuple):
+    self.host.route(event_tuple, self)
+
+  def put(self, event_type, event_time, airport_id, plane_id=-1, source_pid=-1):
+    """Adds an event for one of this LP's airports (or a null message) to the heap"""
+    airport = self.airports.get(airport_id) #None for null messages
+    airport_event = AirportEvent(event_type, event_time, airport, plane_id, source_pid)
+    self.pq.put(airport_event)
+    return airport_event
+
+
+def check_batching():
+  """
+  Batched dispatch handles a group of events before the events it schedules.
+  That is the sequential order only if those come after the group: a plane
+  granted a runway must hold it for some time (and routes have positive
+  distances, see route_network.py)"""
+  if conf.batch_same_time_events and min(conf.runway_time_to_land, conf.runway_time_to_takeoff) <= 0:
+    raise ValueError("batch_same_time_events needs positive runway_time_to_land and runway_time_to_takeoff")
+
+
+def dispatch_group(pq, event):
+  """
+  Pops the other events of the (time, airport, event type) of event and hands
+  them to Airport.handle_events together with it. The events the group
+  schedules at the current time come after it and are popped as groups of
+  their own, as in sequential dispatch"""
+  events = [event]
+  group_key = event.key[:3]
+  while not pq.empty() and pq.peek().key[:3] == group_key:
+    events.append(pq.get())
+  event.airport.handle_events(events)
+
+
+def calculate_lookhead_matrix(network, num_processes):
+  """
+  la[p][q] is the shortest flight time of the fastest planes on a route from an
+  airport of LP p to one of LP q, inf if there is no such route"""
+  num_airports = network.num_airports
   airports_per_process = int(math.ceil(float(num_airports) / num_processes))
-  la = np.zeros((num_processes, num_processes))
-  la.fill(sys.maxint)
-  for i in xrange(num_airports):
-    for j in xrange(num_airports):
-      pid1 = i/airports_per_process
-      pid2 = j/airports_per_process
-      la[pid1][pid2] = min(la[pid1][pid2], distance[i][j])
-      la[pid2][pid1] = la[pid1][pid2]
-  return la
\ No newline at end of file
+  la = np.empty((num_processes, num_processes))
+  la.fill(np.inf)
+  min_travel_time = network.distance * float(conf.plane_speed_min) / conf.plane_speed_max
+  np.minimum.at(la, (network.get_sources() // airports_per_process, network.indices // airports_per_process),
+                min_travel_time)
+  return la
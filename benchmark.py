@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+import argparse
+import numpy as np
+import platform
+import sys
+import time
+
+import airport_conf as conf
+
+from airport_conf import SimulatorParams
+from simulator import bootstrap_initial_events
+from simulator import engines
+from simulator import get_engine
+
+
+"""
+Events per second of an engine on the scenario of airport_conf.py
+
+  python3 benchmark.py --engine singlethread --repeat 3
+  mpiexec -n 3 python3 benchmark.py --engine yawns
+  python3 benchmark.py --min-events-per-sec 60000
+
+Every repetition runs the same simulation with a fresh simulator and the best
+one is reported. With --min-events-per-sec the benchmark exits with status 1
+when the engine is slower, to catch performance regressions
+"""
+
+
+def run_once(engine_class):
+  """Returns the wall time (mean over the processes) and the events of a run"""
+  #the complete route network draws from the global generator
+  np.random.seed(conf.seed)
+  sim = engine_class(SimulatorParams())
+  bootstrap_initial_events(sim)
+  sim.barrier()
+  start = time.time()
+  sim.run()
+  end = time.time()
+  sim.close()
+  wall_time = sim.get_mean(end - start)
+  cnt_events = sim.reduce_sum(np.array([sum(airport.cnt_events for airport in sim.airports.values())]))
+  return sim, wall_time, int(cnt_events[0])
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measures the events per second of an engine")
+  parser.add_argument("--engine", choices=sorted(engines), default="singlethread",
+                      help="yawns and nullmsg run under mpiexec")
+  parser.add_argument("--repeat", type=int, default=3, help="runs of the simulation")
+  parser.add_argument("--min-events-per-sec", type=float, default=None,
+                      help="fail if the best run is slower")
+  args = parser.parse_args()
+
+  engine_class = get_engine(args.engine)
+  best_time = None
+  for _ in range(args.repeat):
+    sim, wall_time, cnt_events = run_once(engine_class)
+    if best_time is None or wall_time < best_time:
+      best_time = wall_time
+  if not sim.is_root():
+    return
+  events_per_sec = cnt_events / best_time
+  print("{engine} on Python {version}: {events} events, best of {repeat} runs {time:.3f} s, "
+        "{rate:.0f} events/sec".format(engine=args.engine, version=platform.python_version(),
+                                       events=cnt_events, repeat=args.repeat, time=best_time,
+                                       rate=events_per_sec))
+  if args.min_events_per_sec is not None and events_per_sec < args.min_events_per_sec:
+    print("Slower than {rate:.0f} events/sec".format(rate=args.min_events_per_sec))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
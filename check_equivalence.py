@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import subprocess
+import sys
+
+import airport_conf as conf
+
+from itertools import zip_longest
+from simulator import engines
+from trace_merge import iter_merged
+
+
+"""
+Checks that the simulators produce the same event trace
+
+Every engine writes one output file per LP. The traces are canonicalized by
+(time, airport, event type, plane) and merged in a streaming fashion, so that traces
+of different LP layouts can be compared line by line
+
+  python3 check_equivalence.py --run --np 3
+  python3 check_equivalence.py singlethread yawns
+"""
+
+def find_first_divergence(reference_dir, candidate_dir):
+  """
+  Returns None if both runs have the same trace, otherwise the index of the
+  first differing event and the event of each trace at that index
+  (None if the trace has ended)"""
+  pairs = zip_longest(iter_merged(reference_dir), iter_merged(candidate_dir))
+  for index, (reference_key, candidate_key) in enumerate(pairs):
+    if reference_key != candidate_key:
+      return index, reference_key, candidate_key
+  return None
+
+
+def run_engine(engine, num_processes, mpiexec):
+  if engine not in engines:
+    raise ValueError("Unknown engine " + engine)
+  simulate_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulate.py")
+  cmd = [sys.executable, simulate_path, "--engine", engine]
+  if engine != "singlethread":
+    cmd = mpiexec.split() + ["-n", str(num_processes)] + cmd
+  print("Running: ", " ".join(cmd))
+  subprocess.check_call(cmd)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares the event traces of the simulators")
+  parser.add_argument("output_dirs", nargs="*", default=["singlethread", "yawns", "nullmsg"],
+                      help="output folders, the first one is the reference")
+  parser.add_argument("--run", action="store_true",
+                      help="run the engines to produce the output folders first")
+  parser.add_argument("--np", type=int, default=3, help="number of MPI processes")
+  parser.add_argument("--mpiexec", default="mpiexec", help="MPI launcher command")
+  args = parser.parse_args()
+
+  if args.run:
+    for output_dir in args.output_dirs:
+      run_engine(os.path.basename(os.path.normpath(output_dir)), args.np, args.mpiexec)
+
+  reference_dir = args.output_dirs[0]
+  cnt_divergent = 0
+  for candidate_dir in args.output_dirs[1:]:
+    divergence = find_first_divergence(reference_dir, candidate_dir)
+    if divergence is None:
+      print(candidate_dir, "matches", reference_dir)
+      continue
+    cnt_divergent += 1
+    index, reference_key, candidate_key = divergence
+    print(candidate_dir, "diverges from", reference_dir, "at event", index)
+    print("  ", reference_dir, ": ", reference_key)
+    print("  ", candidate_dir, ": ", candidate_key)
+  print("(events are (time, airport_id, event type, plane_id), seed =", conf.seed, ")")
+  sys.exit(1 if cnt_divergent > 0 else 0)
+
+
+if __name__ == "__main__":
+  main()
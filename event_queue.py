@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+import heapq
+import numpy as np
+import os
+import tempfile
+
+import airport_conf as conf
+
+from airport_sim import AirportEvent
+
+
+"""
+Event list of a simulator or LP with an optional memory budget
+
+Without a budget (conf.max_events_in_memory = None) this is a plain binary heap.
+With a budget, the events in memory are those before the spill horizon. Once
+the heap grows past the budget, its later half is written to disk as a sorted
+run file and the horizon moves to the first spilled event. New events at or
+after the horizon are collected in a block that is written as another run
+when it is full. When the heap runs empty the next events are merged back
+from the runs, a block of every run file at a time
+"""
+
+#Record of the spilled events, ordered like AirportEvent.key
+spill_record_dtype = np.dtype([("time", "<i8"), ("airport_id", "<i4"), ("event_type", "<i4"),
+                               ("plane_id", "<i4"), ("source_pid", "<i4")])
+spill_record_order = ["time", "airport_id", "event_type", "plane_id"]
+
+
+class SpillRun(object):
+  """
+  A sorted run file read a block at a time. The file is opened for every block,
+  so that processes forked from the owner (see whatif.py) can read it too"""
+  def __init__(self, path, cnt_records, block_size):
+    self.path = path
+    self.cnt_records = cnt_records
+    self.block_size = block_size
+    self.owner_pid = os.getpid()
+    self.offset = 0 #records read so far
+    self.block = []
+    self.head = None #next record as a tuple, None once the run is exhausted
+    self.advance()
+
+  def advance(self):
+    if not self.block:
+      self.read_block()
+    self.head = self.block.pop() if self.block else None
+    if self.head is None:
+      self.remove()
+
+  def read_block(self):
+    cnt_read = min(self.block_size, self.cnt_records - self.offset)
+    if cnt_read <= 0:
+      return
+    with open(self.path, "rb") as run_file:
+      run_file.seek(self.offset * spill_record_dtype.itemsize)
+      records = np.fromfile(run_file, dtype=spill_record_dtype, count=cnt_read)
+    self.offset += cnt_read
+    #reversed, so that the next record is popped from the end
+    self.block = list(zip(records["time"].tolist(), records["airport_id"].tolist(), records["event_type"].tolist(),
+                          records["plane_id"].tolist(), records["source_pid"].tolist()))[::-1]
+
+  def remove(self):
+    if self.owner_pid == os.getpid() and os.path.exists(self.path):
+      os.remove(self.path)
+
+
+class EventQueue(object):
+  def __init__(self, airports, max_events_in_memory=None):
+    self.airports = airports #airport_id -> airport, to restore spilled events
+    self.max_events_in_memory = max_events_in_memory
+    self.heap = []
+    self.size = 0 #events in memory and on disk
+    self.horizon = None #key of the first spilled event, None while nothing is spilled
+    self.spill_block = [] #records at or after the horizon not written yet
+    self.runs = []
+    #Variables to compute statistics
+    self.cnt_spilled = 0
+
+  def put(self, event):
+    self.size += 1
+    if self.horizon is not None and event.key >= self.horizon:
+      self.spill_block.append(event.key + (event.source_pid,))
+      if len(self.spill_block) >= self.get_spill_block_size():
+        self.write_run(self.spill_block)
+        self.spill_block = []
+      return
+    heapq.heappush(self.heap, event)
+    if self.max_events_in_memory is not None and len(self.heap) > self.max_events_in_memory:
+      self.spill()
+
+  def get(self):
+    if not self.heap:
+      self.reload()
+    self.size -= 1
+    return heapq.heappop(self.heap)
+
+  def peek(self):
+    if not self.heap:
+      self.reload()
+    return self.heap[0]
+
+  def empty(self):
+    return self.size == 0
+
+  def qsize(self):
+    return self.size
+
+  def get_spill_block_size(self):
+    return max(1, self.max_events_in_memory // 2)
+
+  def spill(self):
+    """Writes the later half of the heap to disk"""
+    self.heap.sort() #a sorted list is a heap
+    cnt_kept = len(self.heap) // 2
+    spilled = self.heap[cnt_kept:]
+    self.heap = self.heap[:cnt_kept]
+    self.horizon = spilled[0].key
+    self.write_run([event.key + (event.source_pid,) for event in spilled])
+
+  def write_run(self, records):
+    records = np.array(records, dtype=spill_record_dtype)
+    records.sort(order=spill_record_order)
+    fd, path = tempfile.mkstemp(prefix="events_", suffix=".spill", dir=conf.spill_dir)
+    with os.fdopen(fd, "wb") as run_file:
+      run_file.write(records.tobytes())
+    self.runs.append(SpillRun(path, len(records), self.get_spill_block_size()))
+    self.cnt_spilled += len(records)
+
+  def reload(self):
+    """Merges the next events back from the run files into the heap"""
+    if self.spill_block:
+      self.write_run(self.spill_block)
+      self.spill_block = []
+    runs_heap = [(run.head, i) for i, run in enumerate(self.runs) if run.head is not None]
+    heapq.heapify(runs_heap)
+    cnt_load = max(1, self.max_events_in_memory // 2)
+    while runs_heap and len(self.heap) < cnt_load:
+      record, i = heapq.heappop(runs_heap)
+      time, airport_id, event_type, plane_id, source_pid = record
+      self.heap.append(AirportEvent(event_type, time, self.airports.get(airport_id), plane_id, source_pid))
+      self.runs[i].advance()
+      if self.runs[i].head is not None:
+        heapq.heappush(runs_heap, (self.runs[i].head, i))
+    #the events were loaded in order, so the list is a heap
+    self.runs = [run for run in self.runs if run.head is not None]
+    self.horizon = min(run.head for run in self.runs)[:4] if self.runs else None
+
+  def close(self):
+    """Removes the run files of this process"""
+    for run in self.runs:
+      run.remove()
+    self.runs = []
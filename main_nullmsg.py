@@ -1,223 +1,298 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
-import math
 import numpy as np
-import Queue
-import sys
-import time
 
 import airport_conf as conf
 
 from airport_conf import SimulatorParams
-from airport_sim import Airport
-from airport_sim import AirportEvent
 from airport_sim import EventType
-from airport_util import calculate_lookhead_matrix
-from airport_util import EventLogger
+from airport_util import dispatch_group
+from airport_util import LogicalProcess
+from parallel_simulator import comm
+from parallel_simulator import N
+from parallel_simulator import num_lps
+from parallel_simulator import ParallelSimulator
+from parallel_simulator import rank
+from simulator import run_simulation
+from telemetry import is_telemetry_enabled
+from telemetry import sample_names
+from telemetry import SampleTimer
+from telemetry import Telemetry
+from telemetry import telemetry_tag
 
-from collections import defaultdict
 from mpi4py import MPI
 
 
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank() #the rank of this process
-N = comm.Get_size() #the number of parallel processes
-assert conf.num_airports >= N
-airports_per_process = int(math.ceil(float(conf.num_airports)/N))
+WHITE, BLACK = 0, 1 #colors of the ranks and of the termination token
+#Messages are (type, time, airport_id, plane_id, source lp, destination lp, channel clock)
+msg_size = 7
+max_time = np.iinfo(np.int64).max
 
-class NullMessageSimulator:
+class NullMessageLP(LogicalProcess):
+  def __init__(self, lp_id, host):
+    LogicalProcess.__init__(self, lp_id, host)
+    #channel_clock[pid] is the earliest time LP pid can still send an event to this LP.
+    #Every message carries the clock of its channel, real events arriving out of
+    #time order on a channel are fine
+    self.channel_clock = np.zeros(num_lps, dtype=np.int64)
+    self.channel_clock[lp_id] = max_time
+    #LPs without routes to this LP never send anything
+    self.channel_clock[np.isinf(host.la[:, lp_id])] = max_time
+
+  def get_safe_time(self):
+    """Events before the safe time can't be preceded by events still to arrive"""
+    return self.channel_clock.min()
+
+
+class NullMessageSimulator(ParallelSimulator):
   def __init__(self, sim_params):
-    self.incoming_buffer = defaultdict(Queue.PriorityQueue) #incoming queues
-    self.pq = Queue.PriorityQueue()
-    self.sim_params = sim_params
-    self.airports = {} #airport objs for this LP
-    self.curr_time = 0
-    self.la = calculate_lookhead_matrix(sim_params.get_distance_matrix(), N) #lookahead matrix
-    self.create_airports()
-    self.logger = EventLogger(rank, name="nullmsg", shard_output_by_lp=True)
-
-  def get_pid(self, airport_id):
-    """Returns the logical process id corresponding to the airport_id"""
-    return airport_id/airports_per_process
-
-  def create_airports(self):
-    airport_ids = self.sim_params.get_all_airport_ids()
-    for airport_id in airport_ids:
-      #only create the airports this logical process is responsible for
-      if self.get_pid(airport_id) == rank:
-        self.airports[airport_id] = Airport(airport_id, self)
-
-  def get_all_airport_ids(self):
-    return self.sim_params.get_all_airport_ids()
-
-  def get_curr_airport_ids(self):
-    """airport_ids managed by the current LP"""
-    cur_airport_ids = []
-    for airport_id in self.get_all_airport_ids():
-      if self.get_pid(airport_id) == rank:
-        cur_airport_ids.append(airport_id)
-    return cur_airport_ids
-
-  def get_distance(self, airport_id1, airport_id2):
-    return self.sim_params.get_distance_between(airport_id1, airport_id2)
-
-  def schedule(self, event_tuple):
+    ParallelSimulator.__init__(self, sim_params, "nullmsg", lp_class=NullMessageLP)
+    self.send_requests = [] #pending MPI sends, they keep the send buffers alive
+    self.cnt_sent_to = np.array([0]*N) #all MPI msgs sent to each rank
+    self.cnt_received_from = np.array([0]*N) #all MPI msgs received from each rank
+    #State for the Dijkstra-Safra termination detection among the ranks
+    self.cnt_msg_balance = 0 #real events sent minus received through MPI
+    self.color = WHITE
+    self.token = None #(count, color) of the token while this rank holds it
+    self.wave_started = False
+    self.stopped = False
+    self.cnt_null_msgs = 0 #null messages sent by the LPs of this rank
+    self.cnt_event_msgs = 0 #real events sent by the LPs of this rank to other LPs
+    #Every rank samples its progress on its own, rank zero publishes the samples
+    if is_telemetry_enabled():
+      self.telemetry = Telemetry("nullmsg", N) if rank == 0 else None
+      self.sample_timer = SampleTimer()
+
+  def route(self, event_tuple, src_lp):
     event_type = event_tuple[0]
     event_time = event_tuple[1]
     airport_id = event_tuple[2] #this is the destination airport_id
-    if self.get_curr_time() > conf.max_simulation_time \
-            and event_type == EventType.READY_FOR_TAKEOFF: #this ensures a soft stop
-      return
+    plane_id = event_tuple[3]
     #If the event is supposed to happen on the same logical process
     #add it to the heap, otherwise send it right away
-    if airport_id in self.airports.keys():
-      airport = self.airports[airport_id]
-      airport_event = AirportEvent(event_type, event_time, airport, rank)
-      self.pq.put(airport_event)
+    lp_id = self.get_pid(airport_id)
+    if lp_id == src_lp.id:
+      src_lp.put(event_type, event_time, airport_id, plane_id, src_lp.id)
+    else:
+      channel_clock = int(src_lp.get_curr_time() + self.la[src_lp.id][lp_id])
+      self.send(tuple(event_tuple) + (src_lp.id, lp_id, channel_clock))
+      self.cnt_event_msgs += 1
+
+  def send(self, msg_tuple):
+    """
+    Sends a (type, time, airport_id, plane_id, source lp, destination lp, channel clock)
+    message. LPs on this rank get it in memory, others through MPI"""
+    dest_lp_id = msg_tuple[5]
+    if dest_lp_id in self.lps:
+      self.deliver(msg_tuple)
+      return
+    if msg_tuple[0] != EventType.NULL_MSG:
+      self.cnt_msg_balance += 1
+    self.send_to_rank(msg_tuple, self.get_rank(dest_lp_id))
+
+  def send_to_rank(self, msg_tuple, pid, tag=0):
+    self.send_requests.append(comm.Isend(np.array(msg_tuple), dest=pid, tag=tag))
+    self.cnt_sent_to[pid] += 1
+    if len(self.send_requests) >= 1024:
+      #forget the sends that have completed
+      self.send_requests = [req for req in self.send_requests if not req.Test()]
+    while conf.max_pending_sends is not None and len(self.send_requests) > conf.max_pending_sends:
+      #Backpressure: wait for the sends to complete, taking the incoming
+      #messages meanwhile so that the other ranks can complete theirs
+      self.receive_arrived_msgs()
+      self.send_requests = [req for req in self.send_requests if not req.Test()]
+
+  def receive_arrived_msgs(self):
+    """Receives the MPI messages that have already arrived"""
+    status = MPI.Status()
+    while comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+      self.receive_probed_msg(status)
+
+  def receive_probed_msg(self, status):
+    """Receives the message found by a probe, a message or a telemetry sample"""
+    source = status.Get_source()
+    if status.Get_tag() == telemetry_tag:
+      sample = np.zeros(len(sample_names), dtype=np.int64)
+      comm.Recv(sample, source=source, tag=telemetry_tag)
+      self.cnt_received_from[source] += 1
+      self.telemetry.update(source, sample)
+      return
+    msg = np.array([-1]*msg_size)
+    comm.Recv(msg, source=source, tag=0)
+    self.receive(msg, source)
+
+  def receive(self, msg, source):
+    """Handles a message received through MPI"""
+    self.cnt_received_from[source] += 1
+    event_type = msg[0]
+    if event_type == EventType.TERMINATION_TOKEN:
+      self.token = (msg[1], msg[2])
+    elif event_type == EventType.STOP:
+      self.stopped = True
     else:
-      pid = self.get_pid(airport_id)
-      event_tuple_with_src = event_tuple + tuple([rank])
-      comm.Irsend(np.array(event_tuple_with_src), dest=pid)
+      if event_type != EventType.NULL_MSG:
+        self.cnt_msg_balance -= 1
+        self.color = BLACK
+      self.deliver(msg)
+
+  def deliver(self, msg):
+    event_type = msg[0]
+    event_time = msg[1]
+    airport_id = msg[2]
+    plane_id = msg[3]
+    source_pid = msg[4]
+    lp = self.lps[msg[5]]
+    lp.channel_clock[source_pid] = max(lp.channel_clock[source_pid], msg[6])
+    if event_type != EventType.NULL_MSG:
+      # Add the event to local heap
+      lp.put(event_type, event_time, airport_id, plane_id, source_pid)
+
+  def send_null_msgs(self, lp):
+    for pid in range(num_lps):
+      if pid == lp.id or np.isinf(self.la[lp.id][pid]):
+        continue
+      channel_clock = int(lp.get_curr_time() + self.la[lp.id][pid])
+      self.send((EventType.NULL_MSG, channel_clock, -1, -1, lp.id, pid, channel_clock))
+      self.cnt_null_msgs += 1
 
-  def get_curr_time(self):
-    return self.curr_time
+  def process_safe_events(self, lp):
+    """
+    Processes the events of an LP before its safe time and advances its clock
+    as far as possible. Returns whether the LP processed events or advanced"""
+    safe_time = lp.get_safe_time()
+    old_time = lp.get_curr_time()
+    while not lp.pq.empty() and lp.pq.peek().time < safe_time:
+      event = lp.pq.get()
+      lp.curr_time = event.time
+      if conf.batch_same_time_events:
+        #No event at this time is still to arrive
+        dispatch_group(lp.pq, event)
+      else:
+        event.airport.handle_event(event)
+    #No event before the next one or before the safe time can show up anymore
+    nxt_time = safe_time if lp.pq.empty() else min(safe_time, lp.pq.peek().time)
+    lp.curr_time = max(lp.curr_time, nxt_time)
+    if lp.get_curr_time() == old_time:
+      return False
+    if lp.get_curr_time() < max_time:
+      self.send_null_msgs(lp)
+    return True
+
+  def get_telemetry_sample(self):
+    """The progress of this rank, see telemetry.sample_names"""
+    sim_time = min(lp.get_curr_time() for lp in self.lps.values())
+    cnt_events = sum(airport.cnt_events for airport in self.airports.values())
+    pq_size = sum(lp.pq.qsize() for lp in self.lps.values())
+    lags = [lp.pq.peek().time - lp.get_safe_time() for lp in self.lps.values() if not lp.pq.empty()]
+    lbts_lag = max(0, min(lags)) if lags else 0
+    return (sim_time, cnt_events, pq_size, self.cnt_event_msgs + self.cnt_null_msgs, self.cnt_null_msgs, lbts_lag)
+
+  def send_telemetry_sample(self):
+    """Rank zero publishes the latest samples of all ranks, the others send it theirs"""
+    if rank == 0:
+      self.telemetry.update(0, self.get_telemetry_sample())
+      self.telemetry.publish()
+    else:
+      self.send_to_rank(self.get_telemetry_sample(), 0, tag=telemetry_tag)
 
-  def log(self, event):
-    self.logger.log(event, self.curr_time, rank)
+  def gather_telemetry(self):
+    """Gathers the final samples of all ranks once the run has stopped"""
+    samples = np.zeros((N, len(sample_names)), dtype=np.int64) if rank == 0 else None
+    comm.Gather(np.array(self.get_telemetry_sample(), dtype=np.int64), samples, root=0)
+    if rank == 0:
+      self.telemetry.update_all(samples)
+      self.telemetry.publish(finished=True)
 
-  def send_null_msg(self, pid):
-    null_msg_tuple = (EventType.NULL_MSG, int(self.get_curr_time() + self.la[rank][pid]), -1, rank)
-    comm.Irsend(np.array(null_msg_tuple), dest=pid)
+  def is_passive(self):
+    """A rank is passive while none of its LPs has a real event to process"""
+    return all(lp.pq.empty() for lp in self.lps.values())
 
-  def is_any_empty(self):
-    result = False
-    for pid in xrange(N):
-      if pid == rank:
-        continue
-      result = result or self.incoming_buffer[pid].empty()
-    return result
+  def send_token(self, count, color):
+    #The token travels the ring of ranks as (type, count, color, -1, rank, -1, -1)
+    self.send_to_rank((EventType.TERMINATION_TOKEN, count, color, -1, rank, -1, -1), (rank+1) % N)
 
-  def run(self):
-    while self.get_curr_time() <= conf.max_simulation_time + 2*conf.distance_max:
-      if self.get_curr_time() == 0:
-        for pid in xrange(N):
-          if pid == rank:
-            continue
-          self.send_null_msg(pid)
-
-      #Recv messages if any of the incoming queues is empty
-      while self.is_any_empty():
-        msg = np.array([-1, -1, -1, -1])
-        # Wait for messages
-        comm.Recv(msg, source=MPI.ANY_SOURCE)
-        # Add the message to local heap
-        event_type = msg[0]
-        event_time = msg[1]
-        airport_id = msg[2]
-        source_pid = msg[3]
-        airport = None
-        #print msg
-        if event_type != EventType.NULL_MSG:
-          airport = self.airports[airport_id]
-        airport_event = AirportEvent(event_type, event_time, airport, source_pid)
-        self.pq.put(airport_event)
-        self.incoming_buffer[source_pid].put(airport_event)
-
-      event = self.pq.get()
-      if event.source_pid != rank:
-        self.incoming_buffer[event.source_pid].get()
-
-      old_time = self.get_curr_time()
-      self.curr_time = max(self.curr_time, event.time)
-      if event.type != EventType.NULL_MSG:
-        airport = event.airport
-        airport.handle_event(event)
-
-      if self.get_curr_time() - old_time > 0:
-        for pid in xrange(N):
-          if pid == rank:
-            continue
-          #TODO: also don't send a null message to the process on which the next
-          #TODO: event got scheduled. Could return next_airport_id from handle_event
-          self.send_null_msg(pid)
-
-
-
-  def print_statistics(self):
+  def detect_termination(self):
     """
-    Collect stats at LP zero and print them"""
-    total_departures = 0
-    total_landings = 0
-    total_waiting_time = 0
-    total_waiting_time_for_departing = 0
-    total_waiting_time_for_landing = 0
-    total_passengers_arriving = 0
-    for airport in self.airports.values():
-      total_waiting_time_for_landing += airport.total_waiting_time_for_landing
-      total_waiting_time_for_departing += airport.total_waiting_time_for_departing
-      total_waiting_time += airport.total_waiting_time_for_landing +\
-                            airport.total_waiting_time_for_departing
-      total_landings += airport.cnt_landings
-      total_departures += airport.cnt_departures
-      total_passengers_arriving += airport.cnt_passengers_arriving
-
-    stats_recv = np.array([0]*6)
-    stats_send = np.array([total_departures, total_landings, total_waiting_time,
-                           total_waiting_time_for_departing, total_waiting_time_for_landing,
-                           total_passengers_arriving])
-    comm.Reduce(stats_send, stats_recv, op=MPI.SUM, root=0)
-
+    Dijkstra-Safra termination detection. Rank zero sends a token around the ring
+    of ranks, each passive rank adds its count of real events sent minus received
+    and blackens the token if it received a real event since the last visit.
+    A white token returning to a white, passive rank zero with a total count of
+    zero means no real events are left in any heap or in transit"""
+    if not self.is_passive():
+      return
     if rank == 0:
-      print "TOTAL DEPARTURES: ", stats_recv[0]
-      print "TOTAL_LANDINGS  : ", stats_recv[1]
-      print "TOTAL WAIT TIME : ", stats_recv[2]
-      print "TOTAL_WAIT_TIME_FOR_DEPARTURES: ", stats_recv[3]
-      print "TOTAL_WAIT_TIME_FOR_LANDINGS: ", stats_recv[4]
-      print "AVG WAITING TIME: ", float(stats_recv[2])/(stats_recv[0] + stats_recv[1])
-      print "TOTAL PASSENGERS ARRIVING: ", stats_recv[5]
-      print "(Remember landings were preferred over departures)"
-
-
-def bootstrap_initial_events(sim):
-  """
-  Creates the initial events to bootstrap the simulation
-  Each LP is responsible for scheduling a subset of all the planes
-  This ensures that all initial events are in designated heaps
-  and not waiting in any pending send buffers or in transit
-  """
-  airplanes_per_process = int(conf.num_airplanes/N)
-  cnt_planes_for_curr_lp = airplanes_per_process
-  #The zeroeth process takes care of the difference
-  #(num_airplanes needn't be a multiple of N)
-  if rank == 0:
-    diff = conf.num_airplanes - (airplanes_per_process * N)
-    cnt_planes_for_curr_lp += diff
-  cur_airport_ids = sim.get_curr_airport_ids()
-  for i in xrange(cnt_planes_for_curr_lp):
-    airport_id = np.random.choice(cur_airport_ids, 1)[0]
-    init_departure_time = np.random.randint(20, size=1)[0]
-    sim.schedule((EventType.READY_FOR_TAKEOFF, init_departure_time, airport_id))
+      if self.token is not None:
+        count, color = self.token
+        if color == WHITE and self.color == WHITE and count + self.cnt_msg_balance == 0:
+          for pid in range(1, N):
+            self.send_to_rank((EventType.STOP, 0, -1, -1, rank, -1, -1), pid)
+          self.stopped = True
+          return
+      if self.token is not None or not self.wave_started:
+        #start a (new) wave
+        self.wave_started = True
+        self.token = None
+        self.color = WHITE
+        self.send_token(0, WHITE)
+    elif self.token is not None:
+      count, color = self.token
+      self.token = None
+      if self.color == BLACK:
+        color = BLACK
+      self.color = WHITE
+      self.send_token(count + self.cnt_msg_balance, color)
+
+  def drain_messages(self):
+    """
+    Receives the messages still in transit once the simulation has stopped,
+    so that every rank finishes with no pending sends or receives"""
+    cnt_expected = np.array([0]*N)
+    comm.Alltoall(self.cnt_sent_to, cnt_expected)
+    status = MPI.Status()
+    while np.any(self.cnt_received_from < cnt_expected):
+      #telemetry samples are shorter than msg_size
+      msg = np.array([-1]*msg_size)
+      comm.Recv(msg, source=MPI.ANY_SOURCE, status=status)
+      self.cnt_received_from[status.Get_source()] += 1
+    MPI.Request.Waitall(self.send_requests)
+    self.send_requests = []
+
+  def run(self):
+    for lp in self.lps.values():
+      self.send_null_msgs(lp)
+
+    status = MPI.Status()
+    while not self.stopped:
+      if self.sample_timer is not None and self.sample_timer.is_due():
+        self.send_telemetry_sample()
+      #Take the messages that have already arrived
+      self.receive_arrived_msgs()
+      if self.stopped:
+        break
+
+      #Let every LP of this rank process the events that are safe
+      progressed = False
+      for lp in self.lps.values():
+        progressed = self.process_safe_events(lp) or progressed
+      self.detect_termination()
+      if progressed or self.stopped:
+        continue
 
+      #Recv messages since no LP can advance without them
+      # Wait for messages
+      comm.Probe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+      self.receive_probed_msg(status)
+    self.drain_messages()
+    if is_telemetry_enabled():
+      self.gather_telemetry()
 
-def main():
-  sim_params = SimulatorParams()
-  sim = NullMessageSimulator(sim_params)
-  bootstrap_initial_events(sim)
+  def get_engine_counters(self):
+    return {"cnt_null_msgs": self.cnt_null_msgs, "cnt_mpi_msgs": self.cnt_sent_to.sum()}
 
-  comm.Barrier() #Make sure everyone is initialized before running the simulation
-  start = time.time()
-  sim.run()
-  end = time.time()
 
-  comm.Barrier()
-  #The max time is the process time
-  time_send = np.array([end-start])
-  time_recv = np.array([0.0])
-  comm.Allreduce(time_send, time_recv, op=MPI.SUM)
-  if rank == 0:
-    print "Simulation ended in ", float(time_recv[0])/N, "seconds"
-  sim.print_statistics()
+def main():
+  run_simulation(NullMessageSimulator(SimulatorParams()))
 
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
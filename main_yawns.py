@@ -1,145 +1,140 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
-import math
 import numpy as np
-import Queue
 import sys
-import time
 
 import airport_conf as conf
 
 from airport_conf import SimulatorParams
-from airport_sim import Airport
-from airport_sim import AirportEvent
-from airport_sim import EventType
-from airport_util import calculate_lookhead_matrix
-from airport_util import EventLogger
+from airport_util import dispatch_group
+from parallel_simulator import comm
+from parallel_simulator import N
+from parallel_simulator import num_lps
+from parallel_simulator import ParallelSimulator
+from parallel_simulator import rank
+from simulator import run_simulation
+from telemetry import is_telemetry_enabled
+from telemetry import sample_names
+from telemetry import SampleTimer
+from telemetry import Telemetry
 
 from collections import defaultdict
 from mpi4py import MPI
 
 
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank() #the rank of this process
-N = comm.Get_size() #the number of parallel processes
-assert conf.num_airports >= N
-airports_per_process = int(math.ceil(float(conf.num_airports)/N))
-
-class YawnsSimulator:
+class YawnsSimulator(ParallelSimulator):
   def __init__(self, sim_params):
-    self.outgoing_buffer = defaultdict(list) #map from pid to list of event tuples
-    self.pq = Queue.PriorityQueue()
-    self.sim_params = sim_params
-    self.airports = {} #airport objs for this LP
-    self.curr_time = 0
-    self.la = calculate_lookhead_matrix(sim_params.get_distance_matrix(), N) #lookahead matrix
-    self.create_airports()
-    self.logger = EventLogger(rank, name="yawns", shard_output_by_lp=True)
-
-  def get_pid(self, airport_id):
-    """Returns the logical process id corresponding to the airport_id"""
-    return airport_id/airports_per_process
-
-  def create_airports(self):
-    airport_ids = self.sim_params.get_all_airport_ids()
-    for airport_id in airport_ids:
-      #only create the airports this logical process is responsible for
-      if self.get_pid(airport_id) == rank:
-        self.airports[airport_id] = Airport(airport_id, self)
-
-  def get_all_airport_ids(self):
-    return self.sim_params.get_all_airport_ids()
-
-  def get_curr_airport_ids(self):
-    """airport_ids managed by the current LP"""
-    cur_airport_ids = []
-    for airport_id in self.get_all_airport_ids():
-      if self.get_pid(airport_id) == rank:
-        cur_airport_ids.append(airport_id)
-    return cur_airport_ids
-
-  def get_distance(self, airport_id1, airport_id2):
-    return self.sim_params.get_distance_between(airport_id1, airport_id2)
-
-  def schedule(self, event_tuple):
+    #a window must be able to process an event, or no LP ever advances
+    if conf.max_outgoing_events is not None and conf.max_outgoing_events < 1:
+      raise ValueError("max_outgoing_events must be at least 1 (None for no limit), got " +
+                       str(conf.max_outgoing_events))
+    ParallelSimulator.__init__(self, sim_params, "yawns")
+    self.outgoing_buffer = defaultdict(list) #map from rank to list of event tuples
+    self.local_buffer = defaultdict(list) #map from lp_id to event tuples for LPs on this rank
+    self.cnt_windows = 0 #synchronization windows of the run
+    self.cnt_mpi_msgs = 0 #events sent to other ranks
+    self.cnt_buffered = 0 #events waiting in the outgoing and local buffers
+    #Rank zero decides when the ranks sample their progress
+    if rank == 0 and is_telemetry_enabled():
+      self.telemetry = Telemetry("yawns", N)
+      self.sample_timer = SampleTimer()
+
+  def route(self, event_tuple, src_lp):
     event_type = event_tuple[0]
     event_time = event_tuple[1]
     airport_id = event_tuple[2]
-    if self.get_curr_time() > conf.max_simulation_time \
-            and event_type == EventType.READY_FOR_TAKEOFF: #this ensures a soft stop
-      return
+    plane_id = event_tuple[3]
     #If the event is supposed to happen on the same logical process
-    #add it to the heap, otherwise add it to the corresponding outgoing queue
-    if airport_id in self.airports.keys():
-      airport = self.airports[airport_id]
-      airport_event = AirportEvent(event_type, event_time, airport)
-      self.pq.put(airport_event)
+    #add it to the heap. Events for other LPs on this rank wait in memory and
+    #events for other ranks in the outgoing queue until the next exchange
+    lp_id = self.get_pid(airport_id)
+    if lp_id == src_lp.id:
+      src_lp.put(event_type, event_time, airport_id, plane_id)
+    elif lp_id in self.lps:
+      self.local_buffer[lp_id].append(event_tuple)
+      self.cnt_buffered += 1
     else:
-      pid = self.get_pid(airport_id)
-      self.outgoing_buffer[pid].append(event_tuple)
-
-  def get_curr_time(self):
-    return self.curr_time
+      self.outgoing_buffer[self.get_rank(lp_id)].append(event_tuple)
+      self.cnt_buffered += 1
 
-  def log(self, event):
-    self.logger.log(event, self.curr_time, rank)
+  def is_buffer_full(self):
+    """Backpressure: LPs stop processing their window once the buffers are full"""
+    return conf.max_outgoing_events is not None and self.cnt_buffered >= conf.max_outgoing_events
 
 
   def exchange_messages(self):
+    self.cnt_buffered = 0
+    #Deliver the events between LPs of this rank
+    for lp_id in self.local_buffer.keys():
+      for event_tuple in self.local_buffer[lp_id]:
+        self.lps[lp_id].put(*event_tuple)
+      self.local_buffer[lp_id] = []
     outgoing_sizes = []
-    for pid in xrange(0, N):
-      #this LP sends len(self.outgoing_lists[pid]) msgs to LP=pid
+    for pid in range(0, N):
+      #this rank sends len(self.outgoing_buffer[pid]) msgs to rank=pid
       outgoing_sizes.append(len(self.outgoing_buffer[pid]))
-    assert outgoing_sizes[rank] == 0 #No messages should be sent from airports in this LP
+    assert outgoing_sizes[rank] == 0 #No messages should be sent from airports in this rank
     outgoing_sizes = np.array(outgoing_sizes)
     incoming_sizes = np.array([0]*N)
     comm.Allreduce(outgoing_sizes, incoming_sizes, op=MPI.SUM)
     #Send outgoing messages asynchronously
+    #(the requests keep the send buffers alive until the sends complete)
+    send_requests = []
     for pid in self.outgoing_buffer.keys():
       if pid == rank:
         continue
       for event_tuple in self.outgoing_buffer[pid]:
-        comm.Irsend(np.array(event_tuple), dest=pid)
+        send_requests.append(comm.Isend(np.array(event_tuple), dest=pid))
+        self.cnt_mpi_msgs += 1
       self.outgoing_buffer[pid] = [] #clear the list after sending messages
     #Recv incoming messages synchronously and add them to heap
     cnt_expected_recv = incoming_sizes[rank]
     cnt_actual_received = 0
     while cnt_actual_received < cnt_expected_recv:
-      incoming_event_tuple = np.array([-1, -1, -1])
+      incoming_event_tuple = np.array([-1, -1, -1, -1])
       comm.Recv(incoming_event_tuple, source=MPI.ANY_SOURCE)
       cnt_actual_received += 1
       event_type = incoming_event_tuple[0]
       event_time = incoming_event_tuple[1]
       airport_id = incoming_event_tuple[2]
-      airport = self.airports[airport_id]
-      assert self.get_pid(airport_id) == rank
-      airport_event = AirportEvent(event_type, event_time, airport)
-      self.pq.put(airport_event)
+      plane_id = incoming_event_tuple[3]
+      assert self.is_local_airport(airport_id)
+      self.lps[self.get_pid(airport_id)].put(event_type, event_time, airport_id, plane_id)
+    MPI.Request.Waitall(send_requests)
 
 
   def get_lbts(self):
-    send_clock = np.array([0]*N)
-    recv_clock = np.array([0]*N)
-    send_clock[rank] = self.get_curr_time()
+    """Returns the lbts of every LP as an array indexed by lp_id"""
+    send_clock = np.array([0]*num_lps)
+    recv_clock = np.array([0]*num_lps)
+    for lp in self.lps.values():
+      send_clock[lp.id] = lp.get_curr_time()
     comm.Allreduce(send_clock, recv_clock, op=MPI.SUM)
-    recv_clock = recv_clock + self.la[rank]
-    recv_clock[rank] = sys.maxint
-    return np.min(recv_clock)
+    #bound[j][i] is the earliest time LP j can send a message to LP i
+    bound = recv_clock.reshape((num_lps, 1)) + self.la
+    np.fill_diagonal(bound, sys.maxsize)
+    #An LP without routes from other LPs only gets its own events
+    return np.minimum(np.min(bound, axis=0), sys.maxsize // 2)
 
   def run(self):
     voteToHalt = False
-    lbts = 0
+    lbts = np.array([0]*num_lps)
     while not voteToHalt:
-      while not self.pq.empty():
-        event = self.pq.get()
-        if event.time > lbts:
-          self.pq.put(event)
-          break
-        self.curr_time = event.time
-        airport = event.airport
-        airport.handle_event(event)
-      #update clock
-      self.curr_time = lbts
+      self.cnt_windows += 1
+      for lp in self.lps.values():
+        while not lp.pq.empty():
+          if lp.pq.peek().time > lbts[lp.id] or self.is_buffer_full():
+            break
+          event = lp.pq.get()
+          lp.curr_time = event.time
+          if conf.batch_same_time_events:
+            dispatch_group(lp.pq, event)
+            continue
+          airport = event.airport
+          airport.handle_event(event)
+        #update clock, all events up to the clock are processed (an LP stopped
+        #by backpressure may still have events at the time of its next event)
+        lp.curr_time = lbts[lp.id] if lp.pq.empty() else min(lbts[lp.id], lp.pq.peek().time - 1)
 
       # Barrier sync
       comm.Barrier()
@@ -151,91 +146,51 @@ class YawnsSimulator:
       lbts = self.get_lbts()
 
       #voteToHalt (find whether simulation should end or not)
-      out = np.array([0] * N)
-      if self.pq.empty():
+      #the last entry is set by rank zero when a telemetry sample is due
+      out = np.array([0] * (N + 1))
+      if all(lp.pq.empty() for lp in self.lps.values()):
         out[rank] = 1 #Im voting to halt
-      res = np.array([0] * N)
+      if self.sample_timer is not None and self.sample_timer.is_due():
+        out[N] = 1
+      res = np.array([0] * (N + 1))
       comm.Allreduce(out, res, op=MPI.SUM)
+      if res[N] > 0:
+        self.gather_telemetry(lbts)
       #If heaps at all LP's are empty then voteToHalt
-      if np.sum(res) == N:
+      if np.sum(res[:N]) == N:
         voteToHalt=True
-
-
-  def print_statistics(self):
-    """
-    Collect stats at LP zero and print them"""
-    total_departures = 0
-    total_landings = 0
-    total_waiting_time = 0
-    total_waiting_time_for_departing = 0
-    total_waiting_time_for_landing = 0
-    total_passengers_arriving = 0
-    for airport in self.airports.values():
-      total_waiting_time_for_landing += airport.total_waiting_time_for_landing
-      total_waiting_time_for_departing += airport.total_waiting_time_for_departing
-      total_waiting_time += airport.total_waiting_time_for_landing +\
-                            airport.total_waiting_time_for_departing
-      total_landings += airport.cnt_landings
-      total_departures += airport.cnt_departures
-      total_passengers_arriving += airport.cnt_passengers_arriving
-
-    stats_recv = np.array([0]*6)
-    stats_send = np.array([total_departures, total_landings, total_waiting_time,
-                           total_waiting_time_for_departing, total_waiting_time_for_landing,
-                           total_passengers_arriving])
-    comm.Reduce(stats_send, stats_recv, op=MPI.SUM, root=0)
-
+    if is_telemetry_enabled():
+      self.gather_telemetry(lbts, finished=True)
+
+  def get_telemetry_sample(self, lbts):
+    """The progress of this rank, see telemetry.sample_names"""
+    sim_time = min(lp.get_curr_time() for lp in self.lps.values())
+    cnt_events = sum(airport.cnt_events for airport in self.airports.values())
+    pq_size = sum(lp.pq.qsize() for lp in self.lps.values())
+    lags = [lp.pq.peek().time - lbts[lp.id] for lp in self.lps.values() if not lp.pq.empty()]
+    lbts_lag = max(0, min(lags)) if lags else 0
+    return (sim_time, cnt_events, pq_size, self.cnt_mpi_msgs, 0, lbts_lag)
+
+  def gather_telemetry(self, lbts, finished=False):
+    """Gathers the samples of all ranks at a window boundary, rank zero publishes them"""
+    samples = np.zeros((N, len(sample_names)), dtype=np.int64) if rank == 0 else None
+    comm.Gather(np.array(self.get_telemetry_sample(lbts), dtype=np.int64), samples, root=0)
     if rank == 0:
-      print "TOTAL DEPARTURES: ", stats_recv[0]
-      print "TOTAL_LANDINGS  : ", stats_recv[1]
-      print "TOTAL WAIT TIME : ", stats_recv[2]
-      print "TOTAL_WAIT_TIME_FOR_DEPARTURES: ", stats_recv[3]
-      print "TOTAL_WAIT_TIME_FOR_LANDINGS: ", stats_recv[4]
-      print "AVG WAITING TIME: ", float(stats_recv[2])/(stats_recv[0] + stats_recv[1])
-      print "TOTAL PASSENGERS ARRIVING: ", stats_recv[5]
-      print "(Remember landings were preferred over departures)"
-
-
-def bootstrap_initial_events(sim):
-  """
-  Creates the initial events to bootstrap the simulation
-  Each LP is responsible for scheduling a subset of all the planes
-  This ensures that all initial events are in designated heaps
-  and not waiting in any pending send buffers or in transit
-  """
-  airplanes_per_process = int(conf.num_airplanes/N)
-  cnt_planes_for_curr_lp = airplanes_per_process
-  #The zeroeth process takes care of the difference
-  #(num_airplanes needn't be a multiple of N)
-  if rank == 0:
-    diff = conf.num_airplanes - (airplanes_per_process * N)
-    cnt_planes_for_curr_lp += diff
-  cur_airport_ids = sim.get_curr_airport_ids()
-  for i in xrange(cnt_planes_for_curr_lp):
-    airport_id = np.random.choice(cur_airport_ids, 1)[0]
-    init_departure_time = np.random.randint(20, size=1)[0]
-    sim.schedule((EventType.READY_FOR_TAKEOFF, init_departure_time, airport_id))
+      self.telemetry.update_all(samples)
+      self.telemetry.publish(finished)
 
+  def get_engine_counters(self):
+    return {"cnt_mpi_msgs": self.cnt_mpi_msgs}
 
-def main():
-  sim_params = SimulatorParams()
-  sim = YawnsSimulator(sim_params)
-  bootstrap_initial_events(sim)
+  def get_engine_metrics(self):
+    engine_metrics = ParallelSimulator.get_engine_metrics(self)
+    engine_metrics["cnt_windows"] = self.cnt_windows
+    return engine_metrics
 
-  comm.Barrier() #Make sure everyone is initialized before running the simulation
-  start = time.time()
-  sim.run()
-  end = time.time()
 
-  comm.Barrier()
-  #The max time is the process time
-  time_send = np.array([end-start])
-  time_recv = np.array([0.0])
-  comm.Allreduce(time_send, time_recv, op=MPI.SUM)
-  if rank == 0:
-    print "Simulation ended in ", float(time_recv[0])/N, "seconds"
-  sim.print_statistics()
+def main():
+  run_simulation(YawnsSimulator(SimulatorParams()))
 
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
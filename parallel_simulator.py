@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+import math
+import numpy as np
+
+import airport_conf as conf
+
+from airport_util import calculate_lookhead_matrix
+from airport_util import EventLogger
+from airport_util import LogicalProcess
+from simulator import Simulator
+
+from mpi4py import MPI
+
+
+"""
+Base of the MPI simulators (YAWNS and null messages)
+
+Every rank hosts conf.lps_per_rank logical processes (LPs) and every LP a
+contiguous block of airports_per_lp airports. The collective operations of
+Simulator are MPI reductions to rank zero
+"""
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank() #the rank of this process
+N = comm.Get_size() #the number of parallel processes
+num_lps = N * conf.lps_per_rank #the number of logical processes
+assert conf.num_airports >= num_lps
+airports_per_lp = int(math.ceil(float(conf.num_airports)/num_lps))
+
+
+class ParallelSimulator(Simulator):
+  def __init__(self, sim_params, name, lp_class=LogicalProcess):
+    Simulator.__init__(self, sim_params, name)
+    self.lps = {} #LPs hosted by this rank
+    self.la = calculate_lookhead_matrix(sim_params.get_route_network(), num_lps) #lookahead matrix
+    self.create_airports(lp_class)
+    self.logger = EventLogger(rank, name=name, shard_output_by_lp=True)
+
+  def get_pid(self, airport_id):
+    """Returns the logical process id corresponding to the airport_id"""
+    return airport_id // airports_per_lp
+
+  def get_rank(self, lp_id):
+    """Returns the rank hosting the logical process lp_id"""
+    return lp_id // conf.lps_per_rank
+
+  def create_airports(self, lp_class):
+    for lp_id in range(rank*conf.lps_per_rank, (rank+1)*conf.lps_per_rank):
+      self.lps[lp_id] = lp_class(lp_id, self)
+      self.event_queues.append(self.lps[lp_id].pq)
+    #only create the airports the LPs of this rank are responsible for
+    first_airport_id = rank * conf.lps_per_rank * airports_per_lp
+    last_airport_id = min(conf.num_airports, first_airport_id + conf.lps_per_rank * airports_per_lp)
+    for airport_id in range(first_airport_id, last_airport_id):
+      self.airports[airport_id] = self.lps[self.get_pid(airport_id)].add_airport(airport_id)
+
+  def schedule(self, event_tuple):
+    """Schedules an event on the LP owning the airport (used for bootstrapping)"""
+    self.lps[self.get_pid(event_tuple[2])].schedule(event_tuple)
+
+  def is_root(self):
+    return rank == 0
+
+  def reduce_sum(self, values):
+    total = np.zeros_like(values)
+    comm.Reduce(values, total, op=MPI.SUM, root=0)
+    return total
+
+  def gather(self, value):
+    values = np.zeros(N)
+    comm.Gather(np.array([value], dtype=float), values, root=0)
+    return values
+
+  def barrier(self):
+    comm.Barrier()
+
+  def get_mean(self, value):
+    total = np.array([0.0])
+    comm.Allreduce(np.array([float(value)]), total, op=MPI.SUM)
+    return float(total[0]) / N
+
+  def get_engine_metrics(self):
+    return {"engine": self.name, "num_ranks": N, "num_lps": num_lps}
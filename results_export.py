@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+import glob
+import numpy as np
+import os
+
+import airport_conf as conf
+
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+except ImportError:
+  pa = None
+
+
+"""
+Columnar export of the results of a run
+
+Every run appends one replication to a results folder. Its tables are
+  airports: per-airport counters and waiting time histograms
+  planes: per-plane counters of the fleet
+  engine: one row of engine performance metrics
+  config: one row with the settings of airport_conf.py
+and every table has a run_id column. A replication is written as one .npy file
+per column, <results_dir>/run_<run_id>/<table>.<column>.npy, or with pyarrow as
+<results_dir>/<table>/run_<run_id>.parquet so that every table folder is a
+Parquet dataset. Run ids are reserved with an exclusively created
+<results_dir>/run_<run_id>.id, so runs can append to the same folder
+concurrently. load_results concatenates all replications and reads only the
+requested columns, the .npy files are memory-mapped
+
+  import results_export
+  results = results_export.load_results("results", columns=["total_waiting_time_for_landing"])
+  results["airports"]["total_waiting_time_for_landing"]
+"""
+
+airport_counter_names = ("cnt_landings", "cnt_departures", "cnt_waiting_to_land", "cnt_waiting_to_depart",
+                         "total_waiting_time_for_landing", "total_waiting_time_for_departing",
+                         "cnt_passengers_arriving", "cnt_planes_grounded", "cnt_events")
+airport_histogram_names = ("landing_waiting_time_hist", "departure_waiting_time_hist")
+plane_counter_names = ("cnt_flights", "time_in_air", "passengers_flown")
+table_names = ("airports", "planes", "engine", "config")
+
+
+def collect_airport_stats(airports):
+  """
+  Per-airport counters and histograms indexed by airport_id. Airports that are
+  not in airports (hosted by other ranks) are zero, so the stats of all ranks
+  add up with a sum reduction"""
+  stats = {}
+  for name in airport_counter_names:
+    stats[name] = np.zeros(conf.num_airports, dtype=np.int64)
+  for name in airport_histogram_names:
+    stats[name] = np.zeros((conf.num_airports, conf.num_waiting_time_bins), dtype=np.int64)
+  for airport_id, airport in airports.items():
+    for name in airport_counter_names + airport_histogram_names:
+      stats[name][airport_id] = getattr(airport, name)
+  return stats
+
+
+def get_run_config():
+  """The scalar settings of airport_conf.py, others (dicts) as their repr"""
+  config = {}
+  for name, value in sorted(vars(conf).items()):
+    if name.startswith("_") or name == "np" or callable(value):
+      continue
+    config[name] = value if isinstance(value, (bool, int, float, str)) else repr(value)
+  return config
+
+
+def get_results_format():
+  if conf.results_format == "auto":
+    return "parquet" if pa is not None else "npy"
+  if conf.results_format == "parquet" and pa is None:
+    raise ImportError("results_format = 'parquet' requires pyarrow")
+  return conf.results_format
+
+
+class ResultsWriter:
+  def __init__(self, results_dir, results_format=None):
+    self.results_dir = results_dir
+    self.results_format = results_format if results_format is not None else get_results_format()
+    if not os.path.exists(self.results_dir):
+      os.makedirs(self.results_dir)
+
+  def reserve_run_id(self):
+    """
+    Replications are numbered in the order they are appended. The first free id
+    is taken by creating its run_<run_id>.id file, which fails if another run
+    has created it first"""
+    run_id = len(glob.glob(os.path.join(self.results_dir, "run_*.id")))
+    while True:
+      id_path = os.path.join(self.results_dir, "run_{r:05d}.id".format(r=run_id))
+      try:
+        os.close(os.open(id_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return run_id
+      except FileExistsError:
+        run_id += 1
+
+  def append(self, airport_stats, fleet, plane_stats, engine_metrics):
+    """
+    Appends a replication, airport_stats and plane_stats hold the stats summed
+    over all ranks. Returns the run_id"""
+    run_id = self.reserve_run_id()
+    airports = {"run_id": np.full(conf.num_airports, run_id, dtype=np.int64),
+                "airport_id": np.arange(conf.num_airports, dtype=np.int64)}
+    airports.update(airport_stats)
+    planes = {"run_id": np.full(conf.num_airplanes, run_id, dtype=np.int64),
+              "plane_id": np.arange(conf.num_airplanes, dtype=np.int64),
+              "capacity": fleet.capacity, "speed": fleet.speed}
+    planes.update(plane_stats)
+    engine = dict(engine_metrics)
+    engine["run_id"] = run_id
+    config = get_run_config()
+    config["run_id"] = run_id
+    tables = {"airports": airports, "planes": planes,
+              "engine": dict((name, np.array([value])) for name, value in engine.items()),
+              "config": dict((name, np.array([value])) for name, value in config.items())}
+    if self.results_format == "npy":
+      run_dir = os.path.join(self.results_dir, "run_{r:05d}".format(r=run_id))
+      os.mkdir(run_dir)
+      #config last, with run_id as its last column: a run is loaded once config.run_id.npy exists
+      for table_name in table_names:
+        for name, values in tables[table_name].items():
+          np.save(os.path.join(run_dir, table_name + "." + name + ".npy"), values)
+    else:
+      for table_name, columns in tables.items():
+        table_dir = os.path.join(self.results_dir, table_name)
+        if not os.path.exists(table_dir):
+          os.mkdir(table_dir)
+        table = pa.Table.from_pydict(dict((name, pa.array(values.tolist())) for name, values in columns.items()))
+        pq.write_table(table, os.path.join(table_dir, "run_{r:05d}.parquet".format(r=run_id)))
+    return run_id
+
+
+def concatenate_columns(runs):
+  """
+  Concatenates the columns of the tables of several runs. Columns missing in
+  a run (metrics of another engine) are filled with NaN"""
+  names = sorted(set(name for columns in runs for name in columns))
+  table = {}
+  for name in names:
+    parts = []
+    for columns in runs:
+      if name in columns:
+        parts.append(columns[name])
+      else:
+        parts.append(np.full(len(columns["run_id"]), np.nan))
+    table[name] = np.concatenate(parts)
+  return table
+
+
+def load_results(results_dir, columns=None):
+  """
+  Returns {table name: {column name: array}} with the rows of all replications.
+  With columns (names of any table) only those and run_id are read"""
+  runs = dict((table_name, []) for table_name in table_names)
+  def is_selected(name):
+    return columns is None or name == "run_id" or name in columns
+  run_id_paths = sorted(glob.glob(os.path.join(results_dir, "run_*", "config.run_id.npy")))
+  if run_id_paths:
+    for run_dir in map(os.path.dirname, run_id_paths):
+      columns_by_table = dict((table_name, {}) for table_name in table_names)
+      for column_path in glob.glob(os.path.join(run_dir, "*.npy")):
+        table_name, name = os.path.basename(column_path)[:-len(".npy")].split(".", 1)
+        if is_selected(name):
+          columns_by_table[table_name][name] = np.load(column_path, mmap_mode="r")
+      for table_name in table_names:
+        runs[table_name].append(columns_by_table[table_name])
+  elif pa is not None:
+    #Read run by run, the engine metrics differ between engines
+    for table_name in table_names:
+      for run_path in sorted(glob.glob(os.path.join(results_dir, table_name, "run_*.parquet"))):
+        names = [name for name in pq.read_schema(run_path).names if is_selected(name)]
+        table = pq.read_table(run_path, columns=names).to_pydict()
+        runs[table_name].append(dict((name, np.array(values)) for name, values in table.items()))
+  if not runs["config"]:
+    raise IOError("No results in " + results_dir)
+  return dict((table_name, concatenate_columns(runs[table_name])) for table_name in table_names)
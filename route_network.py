@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+import airport_conf as conf
+
+try:
+  from scipy.spatial import cKDTree
+except ImportError:
+  cKDTree = None
+
+
+"""
+Route network of the airports
+
+The routes are kept as a sparse adjacency in CSR form: the destinations of
+airport i are indices[indptr[i]:indptr[i+1]] (sorted) and distance holds the
+distance of every route. A network is
+  "complete": every airport connects to every other one, distances are drawn
+              uniformly from [distance_min, distance_max] (O(num_airports^2))
+  "geo": airports get random coordinates and routes to their routes_per_airport
+         nearest airports and to their nearest of num_hub_airports hubs, the hubs
+         connect to each other. Routes go both ways and a ring through all airports
+         keeps the network connected
+  a file: .npz with "coordinates" (num_airports x 2) and "routes" (num_routes x 2)
+          and optionally "distance" per route, or .csv with "src,dst,distance" lines
+Distances are flight times of the slowest planes (see Fleet.get_travel_time)
+"""
+
+chunk_size = 256 #airports per block of the nearest hub search
+
+
+class RouteNetwork(object):
+  def __init__(self, num_airports, src, dst, distance, coordinates=None):
+    """Builds the CSR adjacency from the (src, dst, distance) of every route"""
+    order = np.lexsort((dst, src))
+    src = np.asarray(src)[order]
+    dst = np.asarray(dst)[order]
+    distance = np.asarray(distance)[order]
+    #drop duplicate routes
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    self.num_airports = num_airports
+    self.indices = dst[keep].astype(np.int32)
+    self.distance = distance[keep]
+    self.indptr = np.zeros(num_airports + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src[keep], minlength=num_airports), out=self.indptr[1:])
+    self.coordinates = coordinates
+
+  def get_destinations(self, airport_id):
+    """The destinations of an airport and their distances (views into the CSR arrays)"""
+    start, end = self.indptr[airport_id], self.indptr[airport_id+1]
+    return self.indices[start:end], self.distance[start:end]
+
+  def get_sources(self):
+    """The source airport of every route"""
+    return np.repeat(np.arange(self.num_airports), np.diff(self.indptr))
+
+  def save(self, path):
+    """Saves the network as .npz, see the module docstring"""
+    routes = np.column_stack((self.get_sources(), self.indices))
+    coordinates = self.coordinates if self.coordinates is not None else np.zeros((0, 2))
+    np.savez(path, routes=routes, distance=self.distance, coordinates=coordinates)
+
+
+def get_distance_from_coordinates(coordinates1, coordinates2):
+  distance = np.sqrt(((np.asarray(coordinates1, dtype=float) - coordinates2)**2).sum(axis=-1))
+  return np.maximum(np.rint(distance), conf.distance_min).astype(np.int64)
+
+
+def create_complete_network(num_airports):
+  """
+  Every airport connects to every other one. The distances are drawn from the
+  global generator seeded in airport_conf.py"""
+  d = np.random.randint(conf.distance_min, conf.distance_max+1, size=(num_airports, num_airports))
+  d = d - np.triu(d)
+  d = (d + d.T) // 2
+  src, dst = np.nonzero(~np.eye(num_airports, dtype=bool))
+  return RouteNetwork(num_airports, src, dst, d[src, dst])
+
+
+def get_nearest_neighbours(coordinates, k):
+  """
+  The k nearest other airports of every airport as a (num_airports x k) array.
+  Without scipy the airports are put on a grid with about k airports per cell
+  and the neighbours of the airports of a cell are searched in the cells around it"""
+  num_airports = len(coordinates)
+  k = min(k, num_airports - 1)
+  if k <= 0:
+    return np.zeros((num_airports, 0), dtype=np.int64)
+  if cKDTree is not None:
+    _, neighbours = cKDTree(coordinates).query(coordinates, k+1)
+    return neighbours[:, 1:]
+  num_cells = max(1, int(np.sqrt(num_airports / float(k))))
+  low = coordinates.min(axis=0)
+  extent = np.maximum(coordinates.max(axis=0) - low, 1e-9)
+  cell = np.minimum(((coordinates - low) / extent * num_cells).astype(np.int64), num_cells - 1)
+  cell_id = cell[:, 0] * num_cells + cell[:, 1]
+  order = np.argsort(cell_id, kind="mergesort")
+  cell_start = np.searchsorted(cell_id[order], np.arange(num_cells * num_cells + 1))
+  neighbours = np.empty((num_airports, k), dtype=np.int64)
+  for cx in range(num_cells):
+    for cy in range(num_cells):
+      members = order[cell_start[cx*num_cells + cy]:cell_start[cx*num_cells + cy + 1]]
+      if len(members) == 0:
+        continue
+      radius = 2
+      while True:
+        #the cells of a grid row around the cell are contiguous in order
+        rows = range(max(0, cx - radius), min(num_cells, cx + radius + 1))
+        first_cy, last_cy = max(0, cy - radius), min(num_cells - 1, cy + radius)
+        candidates = np.concatenate([order[cell_start[row*num_cells + first_cy]:cell_start[row*num_cells + last_cy + 1]]
+                                     for row in rows])
+        if len(candidates) > k or radius >= num_cells:
+          break
+        radius *= 2
+      sq_distance = ((coordinates[members][:, np.newaxis, :] - coordinates[candidates][np.newaxis, :, :])**2).sum(axis=2)
+      sq_distance[members[:, np.newaxis] == candidates[np.newaxis, :]] = np.inf
+      nearest = np.argpartition(sq_distance, k-1, axis=1)[:, :k]
+      neighbours[members] = candidates[nearest]
+  return neighbours
+
+
+def create_geo_network(num_airports):
+  rng = np.random.RandomState([conf.seed, num_airports, 1])
+  #airports in a square whose diagonal is distance_max
+  coordinates = rng.random_sample((num_airports, 2)) * conf.distance_max / np.sqrt(2)
+  neighbours = get_nearest_neighbours(coordinates, conf.routes_per_airport)
+  src = [np.repeat(np.arange(num_airports), neighbours.shape[1]), np.arange(num_airports)]
+  dst = [neighbours.ravel(), (np.arange(num_airports) + 1) % num_airports]
+  num_hubs = min(conf.num_hub_airports, num_airports)
+  if num_hubs > 0:
+    hub_ids = np.arange(num_hubs)
+    hub_coordinates = coordinates[hub_ids]
+    nearest_hub = np.empty(num_airports, dtype=np.int64)
+    for start in range(0, num_airports, chunk_size):
+      block = coordinates[start:start+chunk_size]
+      sq_distance = ((block[:, np.newaxis, :] - hub_coordinates[np.newaxis, :, :])**2).sum(axis=2)
+      nearest_hub[start:start+len(block)] = hub_ids[sq_distance.argmin(axis=1)]
+    src += [np.arange(num_airports), np.repeat(hub_ids, num_hubs)]
+    dst += [nearest_hub, np.tile(hub_ids, num_hubs)]
+  src = np.concatenate(src)
+  dst = np.concatenate(dst)
+  #routes go both ways, no route to the airport itself
+  src, dst = np.concatenate((src, dst)), np.concatenate((dst, src))
+  route = src != dst
+  src, dst = src[route], dst[route]
+  distance = get_distance_from_coordinates(coordinates[src], coordinates[dst])
+  return RouteNetwork(num_airports, src, dst, distance, coordinates)
+
+
+def load_network(path, num_airports):
+  if path.endswith(".csv"):
+    routes = np.loadtxt(path, delimiter=",", ndmin=2)
+    src, dst, distance = routes[:, 0].astype(np.int64), routes[:, 1].astype(np.int64), routes[:, 2]
+    coordinates = None
+  else:
+    network_file = np.load(path)
+    src, dst = network_file["routes"][:, 0], network_file["routes"][:, 1]
+    coordinates = None
+    if "coordinates" in network_file.files and len(network_file["coordinates"]) > 0:
+      coordinates = network_file["coordinates"]
+    if "distance" in network_file.files:
+      distance = network_file["distance"]
+    elif coordinates is not None:
+      distance = get_distance_from_coordinates(coordinates[src], coordinates[dst])
+    else:
+      raise ValueError(path + " has neither route distances nor airport coordinates")
+  if max(src.max(), dst.max()) >= num_airports:
+    raise ValueError(path + " has airports beyond num_airports = " + str(num_airports))
+  #a flight takes time, the lookahead of the MPI engines and batching rely on it
+  if np.min(distance) <= 0:
+    raise ValueError(path + " has routes with distances <= 0")
+  network = RouteNetwork(num_airports, src, dst, np.asarray(distance).astype(np.int64), coordinates)
+  #planes landing at an airport without routes could never depart again
+  no_routes = np.flatnonzero(np.diff(network.indptr) == 0)
+  if len(no_routes) > 0:
+    raise ValueError(path + " has no routes leaving airports " + ", ".join(map(str, no_routes[:10])) +
+                     (" and {n} more".format(n=len(no_routes) - 10) if len(no_routes) > 10 else ""))
+  return network
+
+
+def create_route_network(num_airports):
+  """The network of airport_conf.route_network"""
+  if conf.route_network == "complete":
+    return create_complete_network(num_airports)
+  if conf.route_network == "geo":
+    return create_geo_network(num_airports)
+  return load_network(conf.route_network, num_airports)
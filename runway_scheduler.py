@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+import heapq
+
+import airport_conf as conf
+
+
+"""
+Runway scheduling of an airport
+
+An airport has mixed runways, arrival-only runways and departure-only runways.
+Planes that don't get a runway wait in heaps keyed by (request time, plane id),
+so granting a runway is O(log n) however congested the airport is. A freed
+arrival (departure) runway goes to the next plane waiting to land (depart), a
+freed mixed runway is granted according to conf.runway_priority_policy:
+
+  "landing_first": planes waiting to land go before planes waiting to depart
+  "fifo": the plane that requested a runway first goes first, landings first on ties
+  "weighted": the plane with the highest weight * waiting time goes first, where
+              conf.landing_wait_weight > conf.departure_wait_weight accounts for
+              the fuel burnt by a plane circling the airport (landings first on ties)
+"""
+
+LANDING = 0
+DEPARTURE = 1
+
+MIXED = 0
+ARRIVAL_ONLY = 1
+DEPARTURE_ONLY = 2
+
+priority_policies = ("landing_first", "fifo", "weighted")
+
+
+def check_priority_policy(policy):
+  if policy not in priority_policies:
+    raise ValueError("Unknown runway priority policy: " + str(policy) +
+                     ", one of " + ", ".join(priority_policies))
+
+
+def get_runway_counts(airport_id):
+  """The (mixed, arrival-only, departure-only) runway counts of an airport"""
+  runway_counts = conf.runways_by_airport.get(airport_id, (conf.num_runways_per_airport,
+                                                           conf.num_arrival_runways_per_airport,
+                                                           conf.num_departure_runways_per_airport))
+  if runway_counts[MIXED] + runway_counts[ARRIVAL_ONLY] <= 0 or \
+     runway_counts[MIXED] + runway_counts[DEPARTURE_ONLY] <= 0:
+    raise ValueError("AIRPORT-{id} needs runways for both landings and departures, "
+                     "got {counts}".format(id=airport_id, counts=runway_counts))
+  return runway_counts
+
+
+class RunwayScheduler(object):
+  def __init__(self, airport_id, policy=None):
+    self.set_policy(policy if policy is not None else conf.runway_priority_policy)
+    self.cnt_runways = list(get_runway_counts(airport_id))
+    self.cnt_runways_in_use = [0, 0, 0]
+    self.runway_class_of_plane = {} #runway class held by every plane on a runway
+    self.q_waiting = ([], []) #heaps of (request time, plane id) per kind
+    self.wait_weights = (conf.landing_wait_weight, conf.departure_wait_weight)
+
+  def set_policy(self, policy):
+    check_priority_policy(policy)
+    self.policy = policy
+
+  def request(self, kind, plane_id, request_time):
+    """Queues a plane for a runway, it is granted one by the next dispatch"""
+    heapq.heappush(self.q_waiting[kind], (request_time, plane_id))
+
+  def release(self, plane_id):
+    """Frees the runway of a plane that has landed or departed"""
+    runway_class = self.runway_class_of_plane.pop(plane_id)
+    self.cnt_runways_in_use[runway_class] -= 1
+
+  def add_runways(self, runway_class, cnt):
+    """
+    Opens (cnt > 0) or closes (cnt < 0) runways of a class. A closed runway
+    that is in use is taken out of service once its plane is off it"""
+    cnt_runways = self.cnt_runways[runway_class] + cnt
+    if cnt_runways < 0:
+      raise ValueError("Cannot close {cnt} of {total} runways".format(cnt=-cnt, total=self.cnt_runways[runway_class]))
+    self.cnt_runways[runway_class] = cnt_runways
+
+  def has_free_runway(self, runway_class):
+    return self.cnt_runways_in_use[runway_class] < self.cnt_runways[runway_class]
+
+  def dispatch(self, curr_time):
+    """
+    Grants the free runways to waiting planes, returns the (kind, plane id,
+    request time) of the planes that got a runway in the order of the grants"""
+    grants = []
+    for kind, runway_class in ((LANDING, ARRIVAL_ONLY), (DEPARTURE, DEPARTURE_ONLY)):
+      while self.q_waiting[kind] and self.has_free_runway(runway_class):
+        grants.append(self.grant(kind, runway_class))
+    while self.has_free_runway(MIXED):
+      kind = self.select_kind(curr_time)
+      if kind is None:
+        break
+      grants.append(self.grant(kind, MIXED))
+    return grants
+
+  def grant(self, kind, runway_class):
+    request_time, plane_id = heapq.heappop(self.q_waiting[kind])
+    self.cnt_runways_in_use[runway_class] += 1
+    self.runway_class_of_plane[plane_id] = runway_class
+    return kind, plane_id, request_time
+
+  def select_kind(self, curr_time):
+    """The kind of the plane that gets the next mixed runway, None if no plane is waiting"""
+    q_landing, q_departure = self.q_waiting
+    if not q_landing or not q_departure:
+      return LANDING if q_landing else (DEPARTURE if q_departure else None)
+    if self.policy == "landing_first":
+      return LANDING
+    if self.policy == "fifo":
+      return LANDING if q_landing[0][0] <= q_departure[0][0] else DEPARTURE
+    if self.policy == "weighted":
+      landing_score = self.wait_weights[LANDING] * (curr_time - q_landing[0][0])
+      departure_score = self.wait_weights[DEPARTURE] * (curr_time - q_departure[0][0])
+      return LANDING if landing_score >= departure_score else DEPARTURE
+    raise ValueError("Unknown runway priority policy: " + str(self.policy))
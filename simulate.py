@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+
+import argparse
+
+from airport_conf import SimulatorParams
+from simulator import engines
+from simulator import get_engine
+from simulator import run_simulation
+
+
+"""
+Runs a simulation with any engine
+
+  python3 simulate.py --engine singlethread
+  mpiexec -n 3 python3 simulate.py --engine yawns
+  mpiexec -n 3 python3 simulate.py --engine nullmsg
+"""
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs the airport simulation")
+  parser.add_argument("--engine", choices=sorted(engines), default="singlethread",
+                      help="synchronization of the simulation, yawns and nullmsg run under mpiexec")
+  args = parser.parse_args()
+  run_simulation(get_engine(args.engine)(SimulatorParams()))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+import importlib
+import numpy as np
+import time
+
+import airport_conf as conf
+
+from airport_sim import EventType
+from airport_sim import Fleet
+from airport_util import check_batching
+from airport_util import draw_initial_departures
+from airport_util import get_peak_memory_mb
+from results_export import collect_airport_stats
+from results_export import plane_counter_names
+from results_export import ResultsWriter
+
+
+"""
+Engine core shared by the simulators
+
+A Simulator holds the airports of its process, the fleet and the route
+lookups, and runs the bootstrap, the statistics and the export the same way
+for every engine. An engine brings its synchronization: it creates its
+airports, schedules events and implements run(). The collective operations
+(reduce_sum, gather, barrier, get_mean) are local in a single process and
+implemented with MPI by ParallelSimulator (see parallel_simulator.py).
+Engines are registered by name and their modules only imported when used,
+so the single thread engine runs without mpi4py
+"""
+
+#engine name -> (module, simulator class)
+engines = {"singlethread": ("main_singlethread", "SingleThreadSimulator"),
+           "yawns": ("main_yawns", "YawnsSimulator"),
+           "nullmsg": ("main_nullmsg", "NullMessageSimulator")}
+
+
+def get_engine(name):
+  """The simulator class of an engine"""
+  if name not in engines:
+    raise ValueError("Unknown engine " + name + ", one of " + ", ".join(sorted(engines)))
+  module_name, class_name = engines[name]
+  return getattr(importlib.import_module(module_name), class_name)
+
+
+class Simulator(object):
+  def __init__(self, sim_params, name):
+    check_batching()
+    self.sim_params = sim_params
+    self.name = name
+    self.airports = {} #airport objs hosted by this process, airport_id -> airport
+    self.event_queues = [] #event lists of this process, added by the engine that creates them
+    self.fleet = Fleet(conf.num_airplanes)
+    self.telemetry = None
+    self.sample_timer = None
+
+  def get_all_airport_ids(self):
+    return self.sim_params.get_all_airport_ids()
+
+  def is_local_airport(self, airport_id):
+    return airport_id in self.airports
+
+  def get_destinations(self, airport_id):
+    return self.sim_params.get_destinations(airport_id)
+
+  def get_fleet(self):
+    return self.fleet
+
+  def is_root(self):
+    """Whether this process prints and exports the results"""
+    return True
+
+  def reduce_sum(self, values):
+    """The sum of values over all processes, valid at the root"""
+    return values
+
+  def gather(self, value):
+    """The value of every process as an array, valid at the root"""
+    return np.array([value])
+
+  def barrier(self):
+    pass
+
+  def get_mean(self, value):
+    """The mean of value over all processes, valid everywhere"""
+    return value
+
+  def get_cnt_spilled(self):
+    """Events of this process spilled to disk by its event lists"""
+    return sum(pq.cnt_spilled for pq in self.event_queues)
+
+  def get_engine_counters(self):
+    """Counters of this process summed over all processes for the export"""
+    return {}
+
+  def get_engine_metrics(self):
+    """Engine metrics that are the same on every process"""
+    return {"engine": self.name, "num_ranks": 1, "num_lps": 1}
+
+  def close(self):
+    """Flushes the output files and stops the telemetry once the run is done"""
+    self.logger.close()
+    if self.telemetry is not None:
+      self.telemetry.close()
+
+  def reduce_stats(self):
+    """The airport and plane stats (see results_export.py) summed over all processes"""
+    airport_stats = collect_airport_stats(self.airports)
+    plane_stats = dict((name, getattr(self.fleet, name)) for name in plane_counter_names)
+    for stats in (airport_stats, plane_stats):
+      #the same order on every process
+      for name in sorted(stats.keys()):
+        stats[name] = self.reduce_sum(stats[name])
+    return airport_stats, plane_stats
+
+  def print_statistics(self):
+    airport_stats, plane_stats = self.reduce_stats()
+    cnt_spilled = self.reduce_sum(np.array([self.get_cnt_spilled()]))
+    peak_memory = self.gather(get_peak_memory_mb())
+    if not self.is_root():
+      return
+    total_departures = airport_stats["cnt_departures"].sum()
+    total_landings = airport_stats["cnt_landings"].sum()
+    total_waiting_time_for_departing = airport_stats["total_waiting_time_for_departing"].sum()
+    total_waiting_time_for_landing = airport_stats["total_waiting_time_for_landing"].sum()
+    total_waiting_time = total_waiting_time_for_departing + total_waiting_time_for_landing
+    cnt_flights = plane_stats["cnt_flights"]
+    print("TOTAL DEPARTURES: ", total_departures)
+    print("TOTAL_LANDINGS  : ", total_landings)
+    print("TOTAL WAIT TIME : ", total_waiting_time)
+    print("TOTAL_WAIT_TIME_FOR_DEPARTURES: ", total_waiting_time_for_departing)
+    print("TOTAL_WAIT_TIME_FOR_LANDINGS: ", total_waiting_time_for_landing)
+    print("AVG WAITING TIME: ", float(total_waiting_time) / (total_departures + total_landings))
+    print("TOTAL PASSENGERS ARRIVING: ", airport_stats["cnt_passengers_arriving"].sum())
+    print("PLANES GROUNDED AT SOFT STOP: ", airport_stats["cnt_planes_grounded"].sum())
+    print("AVG FLIGHTS PER PLANE: ", cnt_flights.mean())
+    print("AVG PLANE UTILIZATION: ", float(plane_stats["time_in_air"].sum()) /
+                                     (conf.num_airplanes * conf.max_simulation_time))
+    print("AVG LOAD FACTOR: ", float(plane_stats["passengers_flown"].sum()) /
+                               (cnt_flights * self.fleet.capacity).sum())
+    print("EVENTS SPILLED TO DISK: ", cnt_spilled[0])
+    print("PEAK MEMORY PER RANK (MB): ", peak_memory)
+    print("(Runway priority policy: ", conf.runway_priority_policy, ")")
+
+  def export_results(self, wall_time):
+    """Sums the stats of all processes at the root, which appends them to conf.results_dir"""
+    airport_stats, plane_stats = self.reduce_stats()
+    counters = self.get_engine_counters()
+    counter_names = sorted(counters.keys())
+    totals = self.reduce_sum(np.array([counters[name] for name in counter_names], dtype=np.int64))
+    if not self.is_root():
+      return
+    cnt_events = airport_stats["cnt_events"].sum()
+    engine_metrics = self.get_engine_metrics()
+    engine_metrics.update(zip(counter_names, totals))
+    engine_metrics.update({"wall_time": wall_time, "cnt_events": cnt_events,
+                           "events_per_sec": cnt_events / wall_time})
+    run_id = ResultsWriter(conf.results_dir).append(airport_stats, self.fleet, plane_stats, engine_metrics)
+    print("Results appended to ", conf.results_dir, "as run", run_id)
+
+
+def bootstrap_initial_events(sim):
+  """
+  Creates the initial events to bootstrap the simulation
+  Every process draws the initial departures of all the planes and schedules
+  the ones at its own airports
+  This ensures that all initial events are in designated heaps
+  and not waiting in any pending send buffers or in transit
+  """
+  initial_departures = draw_initial_departures(sim.get_all_airport_ids())
+  for plane_id, (airport_id, init_departure_time) in enumerate(initial_departures):
+    sim.fleet.airport_id[plane_id] = airport_id
+    if sim.is_local_airport(airport_id):
+      sim.schedule((EventType.READY_FOR_TAKEOFF, init_departure_time, airport_id, plane_id))
+
+
+def run_simulation(sim):
+  """Runs a simulator from the initial events and reports its results"""
+  bootstrap_initial_events(sim)
+
+  sim.barrier() #Make sure everyone is initialized before running the simulation
+  start = time.time()
+  sim.run()
+  end = time.time()
+  sim.close()
+
+  sim.barrier()
+  #The mean over the processes is the process time
+  wall_time = sim.get_mean(end - start)
+  if sim.is_root():
+    print("Simulation ended in ", wall_time, "seconds")
+  sim.print_statistics()
+  if conf.results_dir is not None:
+    sim.export_results(wall_time)
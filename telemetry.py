@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+import http.server
+import json
+import numpy as np
+import os
+import threading
+import time
+
+import airport_conf as conf
+
+
+"""
+Live telemetry of long runs
+
+Every rank samples its progress at most every conf.telemetry_interval seconds
+of wall time and rank zero publishes the aggregate as JSON, to
+conf.telemetry_file (replaced atomically, so it can be watched) and/or at
+http://localhost:<conf.telemetry_port>/. A sample of a rank is
+  sim_time: simulated time reached by its slowest LP
+  cnt_events: events handled so far
+  pq_size: events in its event lists
+  cnt_msgs: events and null messages sent to other LPs
+  cnt_null_msgs: null messages sent to other LPs
+  lbts_lag: simulated time from its earliest pending event back to the LBTS
+            (safe time) of its LPs, i.e. how far the rank waits for the others
+YAWNS gathers the samples at a window boundary, the null message simulator
+sends them to rank zero asynchronously with telemetry_tag. The rates of a rank
+are taken between its latest two samples, so a sample that arrives after a
+publication doesn't show up as a drop and then a burst. The published metrics
+have the totals, the rates summed over the ranks and a row per rank with the
+age of its latest sample, an old sample points to a stalled rank
+"""
+
+sample_names = ("sim_time", "cnt_events", "pq_size", "cnt_msgs", "cnt_null_msgs", "lbts_lag")
+telemetry_tag = 1 #MPI tag of the samples, events and null messages use tag 0
+
+
+def is_telemetry_enabled():
+  return conf.telemetry_file is not None or conf.telemetry_port is not None
+
+
+class SampleTimer(object):
+  """Tells a rank when its next sample is due"""
+  def __init__(self):
+    self.next_sample_time = time.time() + conf.telemetry_interval
+
+  def is_due(self):
+    now = time.time()
+    if now < self.next_sample_time:
+      return False
+    self.next_sample_time = now + conf.telemetry_interval
+    return True
+
+
+class TelemetryRequestHandler(http.server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    body = self.server.telemetry.get_metrics_json().encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class Telemetry(object):
+  """The samples of all ranks, kept and published by rank zero"""
+  def __init__(self, engine, num_ranks):
+    self.engine = engine
+    self.start_time = time.time()
+    self.samples = np.zeros((num_ranks, len(sample_names)), dtype=np.int64)
+    self.sample_times = np.full(num_ranks, self.start_time) #wall time of the latest sample of every rank
+    self.previous_samples = self.samples.copy() #the sample before the latest one, for the rates
+    self.previous_sample_times = self.sample_times.copy()
+    self.metrics_json = json.dumps({"engine": engine, "wall_time": 0.0, "finished": False})
+    self.lock = threading.Lock() #the HTTP server reads the metrics from its own thread
+    self.server = None
+    if conf.telemetry_port is not None:
+      self.server = http.server.HTTPServer(("localhost", conf.telemetry_port), TelemetryRequestHandler)
+      self.server.telemetry = self
+      server_thread = threading.Thread(target=self.server.serve_forever)
+      server_thread.daemon = True
+      server_thread.start()
+      print("Telemetry at http://localhost:{p}/".format(p=self.server.server_address[1]))
+
+  def update(self, rank, sample):
+    self.previous_samples[rank] = self.samples[rank]
+    self.previous_sample_times[rank] = self.sample_times[rank]
+    self.samples[rank] = sample
+    self.sample_times[rank] = time.time()
+
+  def update_all(self, samples):
+    self.previous_samples[:] = self.samples
+    self.previous_sample_times[:] = self.sample_times
+    self.samples[:] = samples
+    self.sample_times[:] = time.time()
+
+  def get_metrics_json(self):
+    with self.lock:
+      return self.metrics_json
+
+  def publish(self, finished=False):
+    now = time.time()
+    elapsed = np.maximum(self.sample_times - self.previous_sample_times, 1e-9)
+    columns = dict((name, self.samples[:, i]) for i, name in enumerate(sample_names))
+    rates = (self.samples - self.previous_samples) / elapsed[:, np.newaxis]
+    sim_time = min(int(columns["sim_time"].min()), conf.max_simulation_time)
+    cnt_msgs = int(columns["cnt_msgs"].sum())
+    metrics = {"engine": self.engine, "wall_time": now - self.start_time, "finished": finished,
+               "sim_time": sim_time, "progress": float(sim_time) / conf.max_simulation_time,
+               "cnt_events": int(columns["cnt_events"].sum()),
+               "events_per_sec": float(rates[:, sample_names.index("cnt_events")].sum()),
+               "pq_size": int(columns["pq_size"].sum()),
+               "cnt_msgs": cnt_msgs,
+               "msgs_per_sec": float(rates[:, sample_names.index("cnt_msgs")].sum()),
+               "null_msg_ratio": float(columns["cnt_null_msgs"].sum()) / max(1, cnt_msgs),
+               "lbts_lag": int(columns["lbts_lag"].max()),
+               "ranks": []}
+    for rank in range(len(self.samples)):
+      row = dict((name, int(columns[name][rank])) for name in sample_names)
+      row["rank"] = rank
+      row["events_per_sec"] = float(rates[rank, sample_names.index("cnt_events")])
+      row["seconds_since_sample"] = now - self.sample_times[rank]
+      metrics["ranks"].append(row)
+    metrics_json = json.dumps(metrics)
+    with self.lock:
+      self.metrics_json = metrics_json
+    if conf.telemetry_file is not None:
+      tmp_path = conf.telemetry_file + ".tmp"
+      with open(tmp_path, "w") as metrics_file:
+        metrics_file.write(metrics_json)
+      os.rename(tmp_path, conf.telemetry_file)
+
+  def close(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
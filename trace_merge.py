@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+import argparse
+import glob
+import gzip
+import heapq
+import io
+import numpy as np
+import os
+import sys
+
+from airport_util import format_log_line
+from airport_util import parse_log_line
+from airport_util import trace_record_dtype
+
+
+"""
+Streaming k-way merge of the per-LP output files into one time ordered trace
+
+Memory use is bounded by one read buffer per shard and one output block.
+The output is text (.txt) or binary (.bin), optionally gzip compressed (.gz).
+It is written in blocks and <output>.idx holds the first time and the file
+offset of every block, so a time window is read without scanning the file
+
+  python3 trace_merge.py yawns yawns_trace.bin.gz
+  python3 trace_merge.py --window 5000 5100 yawns_trace.bin.gz
+"""
+
+read_buffer_size = 1 << 20 #bytes read at once from every shard
+records_per_block = 1 << 16 #records per output block (and per index entry)
+
+
+def list_shards(output_dir):
+  """The per-LP output files of a run, text or binary"""
+  shard_paths = sorted(glob.glob(os.path.join(output_dir, "output_*.txt")) +
+                       glob.glob(os.path.join(output_dir, "output_*.bin")))
+  if not shard_paths:
+    raise IOError("No output files in " + output_dir)
+  return shard_paths
+
+
+def iter_records(trace_file, binary, buffer_size=read_buffer_size):
+  """Yields the (time, airport_id, event_type, plane_id) records of an open trace file"""
+  if not binary:
+    for line in trace_file:
+      yield parse_log_line(line.decode("ascii"))
+    return
+  record_size = trace_record_dtype.itemsize
+  cnt_records_per_read = max(1, buffer_size // record_size)
+  while True:
+    data = trace_file.read(cnt_records_per_read * record_size)
+    if not data:
+      return
+    records = np.frombuffer(data, dtype=trace_record_dtype)
+    for record in zip(records["time"].tolist(), records["airport_id"].tolist(),
+                      records["event_type"].tolist(), records["plane_id"].tolist()):
+      yield record
+
+
+def iter_shard(shard_path, buffer_size=read_buffer_size):
+  """
+  Yields the records of one output file in canonical order. The file is in
+  time order already, only events at the same time need to be sorted"""
+  binary = shard_path.endswith(".bin")
+  with open(shard_path, "rb", buffer_size) as shard_file:
+    same_time_records = []
+    for record in iter_records(shard_file, binary, buffer_size):
+      if same_time_records and record[0] != same_time_records[0][0]:
+        for same_time_record in sorted(same_time_records):
+          yield same_time_record
+        same_time_records = []
+      same_time_records.append(record)
+    for same_time_record in sorted(same_time_records):
+      yield same_time_record
+
+
+def iter_merged(output_dir, buffer_size=read_buffer_size):
+  """Merges the output files of all LPs of a run into one time ordered stream"""
+  return heapq.merge(*[iter_shard(shard_path, buffer_size) for shard_path in list_shards(output_dir)])
+
+
+class TraceWriter:
+  """
+  Writes a merged trace block by block, see the module docstring for the format.
+  Every block of a compressed trace is its own gzip member, so decompression
+  can start at any indexed offset"""
+  def __init__(self, output_path, block_size=records_per_block):
+    self.output_path = output_path
+    self.binary = ".bin" in os.path.basename(output_path)
+    self.compress = output_path.endswith(".gz")
+    self.block_size = block_size
+    self.output_file = open(output_path, "wb")
+    self.block = []
+    self.index = [] #(first time, file offset) of every block
+
+  def write(self, record):
+    self.block.append(record)
+    if len(self.block) >= self.block_size:
+      self.flush_block()
+
+  def flush_block(self):
+    if not self.block:
+      return
+    self.index.append((self.block[0][0], self.output_file.tell()))
+    if self.binary:
+      data = np.array(self.block, dtype=trace_record_dtype).tobytes()
+    else:
+      data = "".join([format_log_line(time, "AIRPORT-" + str(airport_id), event_type, plane_id)
+                      for time, airport_id, event_type, plane_id in self.block]).encode("ascii")
+    if self.compress:
+      member = io.BytesIO()
+      with gzip.GzipFile(fileobj=member, mode="wb") as gzip_file:
+        gzip_file.write(data)
+      data = member.getvalue()
+    self.output_file.write(data)
+    self.block = []
+
+  def close(self):
+    self.flush_block()
+    self.output_file.close()
+    with open(self.output_path + ".idx", "wb") as index_file:
+      np.save(index_file, np.array(self.index, dtype=np.int64).reshape((-1, 2)))
+
+
+def merge_shards(output_dir, output_path, buffer_size=read_buffer_size, block_size=records_per_block):
+  """Merges the per-LP output files of output_dir into output_path, returns the record count"""
+  writer = TraceWriter(output_path, block_size)
+  cnt_records = 0
+  for record in iter_merged(output_dir, buffer_size):
+    writer.write(record)
+    cnt_records += 1
+  writer.close()
+  return cnt_records
+
+
+def read_window(trace_path, start_time, end_time, buffer_size=read_buffer_size):
+  """Yields the records of a merged trace with start_time <= time <= end_time"""
+  with open(trace_path + ".idx", "rb") as index_file:
+    index = np.load(index_file)
+  if len(index) == 0:
+    return
+  #Events at start_time may begin in the block before the first one starting at start_time
+  block_id = max(0, np.searchsorted(index[:, 0], start_time, side="left") - 1)
+  trace_file = open(trace_path, "rb", buffer_size)
+  trace_file.seek(index[block_id, 1])
+  if trace_path.endswith(".gz"):
+    trace_file = gzip.GzipFile(fileobj=trace_file, mode="rb")
+  try:
+    for record in iter_records(trace_file, ".bin" in os.path.basename(trace_path), buffer_size):
+      if record[0] > end_time:
+        return
+      if record[0] >= start_time:
+        yield record
+  finally:
+    trace_file.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Merges the per-LP output files into one trace")
+  parser.add_argument("paths", nargs="+",
+                      help="OUTPUT_DIR MERGED_TRACE to merge (.txt or .bin, optionally .gz), "
+                           "MERGED_TRACE with --window")
+  parser.add_argument("--window", nargs=2, type=int, metavar=("START", "END"),
+                      help="print the events of a merged trace between START and END")
+  parser.add_argument("--buffer-size", type=int, default=read_buffer_size, help="read buffer in bytes")
+  parser.add_argument("--block-size", type=int, default=records_per_block, help="records per block")
+  args = parser.parse_args()
+
+  if args.window:
+    start_time, end_time = args.window
+    for time, airport_id, event_type, plane_id in read_window(args.paths[0], start_time, end_time,
+                                                              args.buffer_size):
+      sys.stdout.write(format_log_line(time, "AIRPORT-" + str(airport_id), event_type, plane_id))
+    return
+  output_dir, output_path = args.paths
+  cnt_records = merge_shards(output_dir, output_path, args.buffer_size, args.block_size)
+  print("Merged ", cnt_records, "events of", output_dir, "into", output_path)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+
+import argparse
+import ast
+import pickle
+import os
+import traceback
+
+import airport_conf as conf
+
+from airport_conf import SimulatorParams
+from airport_util import check_batching
+from airport_util import EventLogger
+from simulator import bootstrap_initial_events
+from main_singlethread import SingleThreadSimulator
+from results_export import collect_airport_stats
+from runway_scheduler import ARRIVAL_ONLY
+from runway_scheduler import check_priority_policy
+from runway_scheduler import DEPARTURE_ONLY
+from runway_scheduler import get_runway_counts
+from runway_scheduler import MIXED
+
+
+"""
+What-if continuations of a single thread run
+
+The simulation runs once up to the snapshot time, then every perturbation is
+continued from that state in a forked process (the snapshot is shared copy on
+write) next to an unperturbed baseline branch, and the statistics of every
+branch are printed as differences to the baseline
+
+  python3 whatif.py --at 50000 --close-runways 1:1
+  python3 whatif.py --at 50000 --close-runways 1:5 --policy 0:fifo --set required_time_on_ground=150
+
+Every option adds one branch, the events of a branch after the snapshot are
+logged to whatif_<branch>/
+"""
+
+runway_classes = {"mixed": MIXED, "arrival": ARRIVAL_ONLY, "departure": DEPARTURE_ONLY}
+#Settings of airport_conf.py that are read while the simulation runs. The
+#others are read into the airports, runways, fleet and event list when they
+#are created, so changing them at the snapshot would have no effect
+live_settings = ("required_time_on_ground", "runway_time_to_land", "runway_time_to_takeoff",
+                 "max_simulation_time", "batch_same_time_events", "waiting_time_bin_width")
+
+
+def check_airport_id(airport_id):
+  if not 0 <= airport_id < conf.num_airports:
+    raise ValueError("Unknown airport {id}, num_airports = {n}".format(id=airport_id, n=conf.num_airports))
+
+
+def close_runways(airport_id, cnt, runway_class="mixed"):
+  """Perturbation closing cnt runways at an airport (opening them if cnt < 0)"""
+  check_airport_id(airport_id)
+  if runway_class not in runway_classes:
+    raise ValueError("Unknown runway class " + runway_class + ", one of " + ", ".join(sorted(runway_classes)))
+  cnt_runways = get_runway_counts(airport_id)[runway_classes[runway_class]]
+  if cnt > cnt_runways:
+    raise ValueError("Cannot close {cnt} of the {total} {runway_class} runways of AIRPORT-{id}".format(
+                     cnt=cnt, total=cnt_runways, runway_class=runway_class, id=airport_id))
+  def perturb(sim):
+    airport = sim.airports[airport_id]
+    airport.runways.add_runways(runway_classes[runway_class], -cnt)
+    airport.notify_waiting_planes(sim.get_curr_time())
+  return perturb
+
+
+def set_priority_policy(airport_id, policy):
+  """Perturbation switching the runway priority policy of an airport"""
+  check_airport_id(airport_id)
+  check_priority_policy(policy)
+  def perturb(sim):
+    sim.airports[airport_id].runways.set_policy(policy)
+  return perturb
+
+
+def set_conf(name, value):
+  """Perturbation changing a setting of airport_conf.py for the rest of the run"""
+  if name not in live_settings:
+    raise ValueError("Cannot change " + name + " at the snapshot, it is only read when the simulator "
+                     "is created. Settings that can change: " + ", ".join(live_settings) +
+                     " (--close-runways and --policy change the runways)")
+  if type(value) is not type(getattr(conf, name)):
+    raise ValueError("{name} is a {expected}, got {value!r}".format(
+                     name=name, expected=type(getattr(conf, name)).__name__, value=value))
+  #the branch must be valid with the new value
+  old_value = getattr(conf, name)
+  setattr(conf, name, value)
+  try:
+    check_batching()
+  finally:
+    setattr(conf, name, old_value)
+  def perturb(sim):
+    setattr(conf, name, value)
+  return perturb
+
+
+def parse_branches(args):
+  """Returns (name, perturbation) for every branch given on the command line"""
+  branches = []
+  for spec in args.close_runways:
+    fields = spec.split(":")
+    if len(fields) not in (2, 3):
+      raise ValueError("Expected AIRPORT:COUNT[:CLASS], got " + spec)
+    runway_class = fields[2] if len(fields) > 2 else "mixed"
+    branches.append(("close_runways_" + spec.replace(":", "_"),
+                     close_runways(int(fields[0]), int(fields[1]), runway_class)))
+  for spec in args.policy:
+    airport_id, policy = spec.split(":")
+    branches.append(("policy_" + airport_id + "_" + policy, set_priority_policy(int(airport_id), policy)))
+  for spec in args.set:
+    name, value = spec.split("=", 1)
+    try:
+      value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+      raise ValueError("The value of " + spec + " is not a Python literal")
+    branches.append(("set_" + name + "_" + str(value), set_conf(name, value)))
+  return branches
+
+
+def get_summary(sim):
+  """The statistics of a finished branch"""
+  airport_stats = collect_airport_stats(sim.airports)
+  summary = {}
+  for name in ("cnt_departures", "cnt_landings", "total_waiting_time_for_landing",
+               "total_waiting_time_for_departing", "cnt_passengers_arriving", "cnt_planes_grounded"):
+    summary[name] = airport_stats[name].sum()
+  summary["avg_waiting_time"] = float(summary["total_waiting_time_for_landing"] +
+                                      summary["total_waiting_time_for_departing"]) / \
+                                max(1, summary["cnt_departures"] + summary["cnt_landings"])
+  summary["cnt_flights"] = sim.fleet.cnt_flights.sum()
+  for airport_id in sorted(sim.airports.keys()):
+    summary["waiting_time_at_airport_" + str(airport_id)] = \
+      airport_stats["total_waiting_time_for_landing"][airport_id] + \
+      airport_stats["total_waiting_time_for_departing"][airport_id]
+  return summary
+
+
+def fork_branch(sim, name, perturb):
+  """
+  Continues the simulation with a perturbation in a child process, returns the
+  pid of the child and the pipe its summary is written to"""
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid != 0:
+    os.close(write_fd)
+    return pid, os.fdopen(read_fd, "rb")
+  os.close(read_fd)
+  exit_code = 1
+  try:
+    sim.logger = EventLogger(0, name="whatif_" + name)
+    if perturb is not None:
+      perturb(sim)
+    sim.run()
+    sim.logger.close()
+    with os.fdopen(write_fd, "wb") as pipe:
+      pickle.dump(get_summary(sim), pipe, pickle.HIGHEST_PROTOCOL)
+    exit_code = 0
+  except Exception:
+    traceback.print_exc()
+  finally:
+    os._exit(exit_code)
+
+
+def run_branches(sim, branches, num_jobs):
+  """
+  Runs the branches num_jobs at a time, returns their summaries by name. All
+  children of a batch are waited for before a failed branch is reported"""
+  summaries = {}
+  for start in range(0, len(branches), num_jobs):
+    children = []
+    failed = []
+    try:
+      for name, perturb in branches[start:start+num_jobs]:
+        children.append((name,) + fork_branch(sim, name, perturb))
+      for name, pid, pipe in children:
+        #Read before waiting, a child blocks until its summary is read
+        data = pipe.read()
+        if data:
+          summaries[name] = pickle.loads(data)
+    finally:
+      for name, pid, pipe in children:
+        pipe.close()
+        _, status = os.waitpid(pid, 0)
+        if status != 0 or name not in summaries:
+          failed.append(name)
+    if failed:
+      raise RuntimeError("Branches failed: " + ", ".join(failed))
+  return summaries
+
+
+def print_diff(summaries, branch_names):
+  baseline = summaries["baseline"]
+  for name in branch_names:
+    print("BRANCH", name)
+    for key in sorted(baseline.keys()):
+      delta = summaries[name][key] - baseline[key]
+      print("  {key:40s} {value:>14} {delta:>+14}".format(key=key, value=summaries[name][key], delta=delta))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares perturbed continuations of a single thread run")
+  parser.add_argument("--at", type=int, required=True, help="simulated time of the snapshot")
+  parser.add_argument("--close-runways", action="append", default=[], metavar="AIRPORT:COUNT[:CLASS]",
+                      help="close COUNT runways (mixed, arrival or departure) at AIRPORT")
+  parser.add_argument("--policy", action="append", default=[], metavar="AIRPORT:POLICY",
+                      help="switch the runway priority policy of AIRPORT")
+  parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                      help="change a setting of airport_conf.py")
+  parser.add_argument("--jobs", type=int, default=4, help="branches running at the same time")
+  args = parser.parse_args()
+  try:
+    branches = parse_branches(args)
+  except ValueError as e:
+    parser.error(str(e))
+
+  sim = SingleThreadSimulator(SimulatorParams(), name="whatif_prefix")
+  bootstrap_initial_events(sim)
+  sim.run(until=args.at)
+  sim.curr_time = args.at
+  #The branches log to their own folders, nothing buffered may be written twice
+  sim.logger.close()
+  print("Snapshot at ", args.at, "with", sim.pq.qsize(), "pending events")
+  try:
+    summaries = run_branches(sim, [("baseline", None)] + branches, max(1, args.jobs))
+  finally:
+    #the spill files of the snapshot are shared with the branches
+    sim.pq.close()
+  print_diff(summaries, [name for name, _ in branches])
+
+
+if __name__ == "__main__":
+  main()